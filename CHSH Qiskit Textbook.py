@@ -1,23 +1,21 @@
 #import qiskit tools
-from qiskit import QuantumCircuit, ClassicalRegister, QuantumRegister, transpile, Aer, IBMQ
-from qiskit.tools.monitor import job_monitor, backend_monitor, backend_overview
+from qiskit import QuantumCircuit, ClassicalRegister, QuantumRegister, transpile
 
 #import python stuff
-import matplotlib.pyplot as plt
 import numpy as np
 import time
-import matplotlib
-matplotlib.use('TkAgg') # needed this to get plots to display
+import os
 
-# Set devices, if using a real device
+from backend_pool import get_qiskit_backend, get_provider
+from device_select import select_device
+from tracing import tracer, wait_for_job
+
+# Set devices, if using a real device.
+# The account is loaded by the backend pool on first use, not at import,
+# and local simulators (e.g. aer_simulator) never touch IBMQ
 
 # These are Tyler's IBMQ credentials
 #IBMQ.save_account("c8ae97bdd4de2f3db6b76a1bffc979b4bde93e14e9a19993435b8db857e32d0e38c1f1e9c1d083a9a446a84e26b9bd98ec01eea4191a102457345ab43a48663f")
-IBMQ.load_account()
-provider = IBMQ.get_provider('ibm-q')
-quito = provider.get_backend('ibmq_quito')
-
-sim = Aer.get_backend('aer_simulator')
 
 
 def make_chsh_circuit(theta_vec):
@@ -48,6 +46,93 @@ def make_chsh_circuit(theta_vec):
     return chsh_circuits
 
 
+def disjoint_pairs(coupling_map, n_qubits, max_pairs=None):
+    """Pick disjoint coupled qubit pairs, greedily in coupling map order
+
+        Args:
+            coupling_map (list): list of [a, b] physical qubit pairs, or None for all-to-all (simulators)
+            n_qubits (int): number of qubits of the device
+            max_pairs (int): upper limit on the number of pairs, 4 on an all-to-all
+                simulator if None (every pair adds two qubits to the simulated state)
+
+        Returns:
+            List[Tuple]: disjoint (a, b) pairs
+    """
+    if coupling_map is None:
+        max_pairs = max_pairs or 4
+        coupling_map = [(q, q + 1) for q in range(0, min(n_qubits, 2 * max_pairs) - 1, 2)]
+
+    pairs = []
+    used = set()
+    for a, b in sorted(tuple(sorted(edge)) for edge in coupling_map):
+        if a not in used and b not in used:
+            pairs.append((a, b))
+            used.update((a, b))
+
+    return pairs[:max_pairs]
+
+
+def make_packed_chsh_circuits(theta_vec, n_slots):
+    """Return CHSH QuantumCircuits with n_slots (theta, observable) settings
+    each, setting s on qubits 2s, 2s+1 and measured into bits 2s, 2s+1. The
+    settings are taken in the order of make_chsh_circuit, the last circuit
+    may hold fewer of them.
+
+        Args:
+            theta_vec (list): list of values of angles between the bases of Alice and Bob
+            n_slots (int): settings per circuit (qubit pairs available)
+
+        Returns:
+            List[QuantumCircuit]: packed CHSH QuantumCircuits
+    """
+    obs_vec = ['00', '01', '10', '11']
+    settings = [(theta, el) for theta in theta_vec for el in obs_vec]
+
+    packed_circuits = []
+    for start in range(0, len(settings), n_slots):
+        chunk = settings[start:start + n_slots]
+        qc = QuantumCircuit(2 * len(chunk), 2 * len(chunk))
+        for s, (theta, el) in enumerate(chunk):
+            qc.h(2 * s)
+            qc.cx(2 * s, 2 * s + 1)
+            qc.ry(theta, 2 * s)
+            for a in range(2):
+                if el[a] == '1':
+                    qc.h(2 * s + a)
+        qc.measure(range(2 * len(chunk)), range(2 * len(chunk)))
+        packed_circuits.append(qc)
+
+    return packed_circuits
+
+
+def demux_chsh_counts(packed_counts, n_slots):
+    """Split the counts of packed circuits back into one 2 bit counts dict
+    per setting, in the order make_chsh_circuit would have produced them
+
+        Args:
+            packed_counts (list[dict]): counts of the packed circuits
+            n_slots (int): settings per circuit
+
+        Returns:
+            List[dict]: counts per setting, as compute_chsh_witness expects
+    """
+    counts = []
+    for circuit_counts in packed_counts:
+        width = len(next(iter(circuit_counts)).replace(' ', ''))
+        slots = [dict() for _ in range(width // 2)]
+
+        for key, value in circuit_counts.items():
+            key = key.replace(' ', '')
+            for s, slot in enumerate(slots):
+                # qiskit keys are written bit n-1 first, so bits 2s+1, 2s of slot s sit at the end of the key
+                pair = key[len(key) - 2 * s - 2:len(key) - 2 * s]
+                slot[pair] = slot.get(pair, 0) + value
+
+        counts.extend(slots)
+
+    return counts
+
+
 def compute_chsh_witness(counts):
     """Computes expectation values for the CHSH inequality, for each
     angle (theta) between measurement axis.
@@ -101,47 +186,90 @@ def compute_chsh_witness(counts):
     return CHSH1, CHSH2
 
 
-number_of_thetas = 15
-theta_vec = np.linspace(0,2*np.pi,number_of_thetas)
-my_chsh_circuits = make_chsh_circuit(theta_vec)
+def run_chsh(device='ibmq_quito', number_of_thetas=15, shots=8192, pack=False, max_pairs=None):
+    """Run the CHSH experiment on a device
+
+        Args:
+            device (str): name of the backend, e.g. ibmq_quito or aer_simulator, or auto
+                for the device with the lowest expected time to result
+            number_of_thetas (int): number of angles between 0 and 2pi
+            shots (int): shots per circuit
+            pack (bool): place several settings on disjoint coupled qubit pairs of one circuit
+            max_pairs (int): upper limit on the pairs used when packing
+
+        Returns:
+            Tuple(array, List, List): angles and the two measured CHSH witnesses
+    """
+    theta_vec = np.linspace(0,2*np.pi,number_of_thetas)
+    my_chsh_circuits = make_chsh_circuit(theta_vec)
+
+    print(my_chsh_circuits[4].draw())
+    print(my_chsh_circuits[5].draw())
+    print(my_chsh_circuits[6].draw())
+    print(my_chsh_circuits[7].draw())
+
+    # Execute and get counts
+    if device == 'auto':
+        device = select_device(get_provider(), 2, len(my_chsh_circuits), shots)
+    backend = get_qiskit_backend(device)
+
+    attributes = {'ineq': 'chsh', 'n': 2, 'thetas': number_of_thetas, 'shots': shots,
+                  'circuits': len(my_chsh_circuits)}
+
+    if pack:
+        configuration = backend.configuration()
+        pairs = disjoint_pairs(configuration.coupling_map, configuration.n_qubits, max_pairs)
+        print("packing", len(pairs), "settings per circuit on pairs", pairs)
+
+        my_chsh_circuits = make_packed_chsh_circuits(theta_vec, len(pairs))
+        attributes['circuits'] = len(my_chsh_circuits)
+        layouts = [[q for pair in pairs[:qc.num_qubits // 2] for q in pair] for qc in my_chsh_circuits]
 
-print(my_chsh_circuits[4].draw())
-print(my_chsh_circuits[5].draw())
-print(my_chsh_circuits[6].draw())
-print(my_chsh_circuits[7].draw())
+    tic = time.time()
+    with tracer.span("compile", **attributes):
+        if pack:
+            transpiled_circuits = transpile(my_chsh_circuits, backend, initial_layout=layouts)
+        else:
+            transpiled_circuits = transpile(my_chsh_circuits, backend)
+    with tracer.span("submit", **attributes):
+        job_real = backend.run(transpiled_circuits, shots=shots)
+    result_real = wait_for_job(job_real, tracer, **attributes)
+    toc = time.time()
 
+    print(toc-tic)
 
-# Execute and get counts
-result_ideal = sim.run(my_chsh_circuits).result()
+    with tracer.span("analysis", **attributes):
+        counts = result_real.get_counts()
+        if pack:
+            counts = demux_chsh_counts(counts if isinstance(counts, list) else [counts], len(pairs))
+        CHSH1_real, CHSH2_real = compute_chsh_witness(counts)
 
-tic = time.time()
-transpiled_circuits = transpile(my_chsh_circuits, quito)
-job_real = quito.run(transpiled_circuits, shots=8192)
-job_monitor(job_real)
-result_real = job_real.result()
-toc = time.time()
+    return theta_vec, CHSH1_real, CHSH2_real
 
-print(toc-tic)
 
-CHSH1_ideal, CHSH2_ideal = compute_chsh_witness(result_ideal.get_counts())
-CHSH1_real, CHSH2_real = compute_chsh_witness(result_real.get_counts())
+def plot_chsh(theta_vec, CHSH1_real, CHSH2_real, label='Quito', filename='chsh.png'):
+    """Save the measured CHSH witnesses next to filename and render the plot
+    against the exact noiseless curves in the background (Agg, no display).
+
+        Args:
+            theta_vec (array): angles of the measured points
+            CHSH1_real (List): first measured CHSH witness
+            CHSH2_real (List): second measured CHSH witness
+            label (str): legend label of the measured points
+            filename (str): image to write, png or svg
+
+        Returns:
+            Future: resolves to filename once the plot is written
+    """
+    from plotting import save_results, render_async
+
+    results = save_results(os.path.splitext(filename)[0] + '.json', 'chsh',
+                           theta=theta_vec, CHSH1=CHSH1_real, CHSH2=CHSH2_real, label=label)
 
-plt.figure(figsize=(12,8))
-plt.rcParams.update({'font.size': 22})
-plt.plot(theta_vec,CHSH1_ideal,'o-',label = 'CHSH1 Noiseless')
-plt.plot(theta_vec,CHSH2_ideal,'o-',label = 'CHSH2 Noiseless')
+    return render_async(results, filename)
 
-plt.plot(theta_vec,CHSH1_real,'x-',label = 'CHSH1 Quito')
-plt.plot(theta_vec,CHSH2_real,'x-',label = 'CHSH2 Quito')
 
-plt.grid(which='major',axis='both')
-plt.rcParams.update({'font.size': 16})
-plt.legend()
-plt.axhline(y=2, color='r', linestyle='-')
-plt.axhline(y=-2, color='r', linestyle='-')
-plt.axhline(y=np.sqrt(2)*2, color='k', linestyle='-.')
-plt.axhline(y=-np.sqrt(2)*2, color='k', linestyle='-.')
-plt.xlabel('Theta')
-plt.ylabel('CHSH witness')
+if __name__ == "__main__":
 
-plt.show()
+    theta_vec, CHSH1_real, CHSH2_real = run_chsh(device='ibmq_quito', number_of_thetas=15, shots=8192)
+    plot_chsh(theta_vec, CHSH1_real, CHSH2_real, label='Quito', filename='chsh.png').result()
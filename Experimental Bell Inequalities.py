@@ -1,11 +1,30 @@
 from qiskit import QuantumCircuit
-from pytket.extensions.qiskit import IBMQBackend
+from backend_pool import get_backend, get_provider
 from pytket import Circuit
 from pytket.extensions.qiskit import qiskit_to_tk, tk_to_qiskit
-from pytket.utils import expectation_from_counts
 from pytket import OpType
-import collections
+from pytket.circuit import Node, Qubit, Bit
+from readout_mitigation import measured_qubits, calibration_circuits, assignment_matrices, \
+    mitigated_expectation, parity_weights, calibration_cache
+from results_archive import save_run
+from packed_counts import PackedCounts
+from fragments import fragment_cache
+from ghz import ghz_circuit, ghz_schedule, dynamic_ghz_circuit
+from ideal import ideal_value
+from correlators import GeneratedTable
+from parametric import rotation_layer, bind, bindings
+from twirl import flip_layer, flip_masks, instances, untwirl
+from zne import fold, zero_noise
+from shot_stream import ParityAccumulator, result_chunks
+from tracing import tracer, wait_for_results
+from cost_estimate import estimate, enforce, device_timings
+from layout import device_layout
+from device_select import select_device
 import time
+import numpy as np
+
+# this script's circuits, kept apart from what the other scripts cache under the same keys
+fragments = fragment_cache.scoped("inequality")
 
 def mermin3():
     """
@@ -114,9 +133,134 @@ def svet4():
 
     return qc
 
+def svet(n):
+    """
+    :return: qc, GHZ+ state circuit with n qubits, for the generated Svetlichny tests
+    """
+    qc = QuantumCircuit(n,n)
+
+    qc.h(0)
+    for i in range(0,n-1):
+        qc.cnot(i,i+1)
+    qc.barrier()
+
+    return qc
+
+def mermin(n):
+    """
+    :return: qc, GHZ state circuit with n qubits, phase of i, for the generated Mermin tests
+    """
+    qc = QuantumCircuit(n)
+
+    qc.h(0)
+    for i in range(1,n):
+        qc.cnot(0,i)
+    qc.s(0)
+    qc.barrier()
+
+    return qc
+
+# state preparation, measurement bases and coefficients of every inequality
+function_dict = {'mermin3': mermin3, 'mermin4': mermin4, 'mermin5': mermin5, 'mermin6': mermin6, 'mermin7': mermin7,
+                 'svetlichny3': svet3, 'svetlichny4': svet4}
+
+# Mermin measurements for iGHZ state.
+m3=["xxy", "xyx", "yxx", "yyy"]
+coeff_m3= [1.0, 1.0, 1.0, -1.0]
+m4=["xxxy", "xxyx", "xyxx", "yxxx", "xyyy", "yxyy", "yyxy", "yyyx"]
+coeff_m4=[1, 1, 1, 1, -1, -1, -1, -1]
+m5=["xxxxy", "xxxyx", "xxyxx", "xyxxx", "yxxxx",   "xxyyy", "xyyxy", "xyyyx", "xyxyy", "yyyxx", "yyxyx", "yyxxy", "yxyyx", "yxyxy", "yxxyy", "yyyyy"]
+coeff_m5=[1, 1, 1, 1, 1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, 1]
+m6=["xxxxxy", "xxxxyx", "xxxyxx", "xxyxxx", "xyxxxx", "yxxxxx",
+
+    "xxxyyy","xxyxyy",
+    "xxyyxy","xxyyyx",
+    "xyxxyy","xyxyxy",
+    "xyxyyx","xyyxxy",
+    "xyyxyx","xyyyxx",
+    "yxxxyy","yxxyxy",
+    "yxxyyx","yxyxxy",
+    "yxyxyx","yxyyxx",
+    "yyxxxy","yyxxyx",
+    "yyxyxx","yyyxxx",
+
+    "yyyyyx", "yyyyxy", "yyyxyy", "yyxyyy", "yxyyyy", "xyyyyy"]
+coeff_m6=[1, 1, 1, 1, 1, 1,
+          -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1,
+         1, 1, 1, 1, 1, 1]
+m7=["xxxxxxy", "xxxxxyx", "xxxxyxx", "xxxyxxx", "xxyxxxx", "xyxxxxx", "yxxxxxx",
+
+    # 35 with 3 y's
+    "xxxxyyy", "xxxyxyy",
+    "xxxyyxy", "xxxyyyx",
+    "xxyxxyy", "xxyxyxy",
+    "xxyxyyx", "xxyyxxy",
+    "xxyyxyx", "xxyyyxx",
+    "xyxxxyy", "xyxxyxy",
+    "xyxxyyx", "xyxyxxy",
+    "xyxyxyx", "xyxyyxx",
+    "xyyxxxy", "xyyxxyx",
+    "xyyxyxx", "xyyyxxx",
+    "yxxxxyy", "yxxxyxy",
+    "yxxxyyx", "yxxyxxy",
+    "yxxyxyx", "yxxyyxx",
+    "yxyxxxy", "yxyxxyx",
+    "yxyxyxx", "yxyyxxx",
+    "yyxxxxy", "yyxxxyx",
+    "yyxxyxx", "yyxyxxx",
+    "yyyxxxx",
+
+    # 21 with 5 y's
+    "xxyyyyy", "xyxyyyy",
+    "xyyxyyy", "xyyyxyy",
+    "xyyyyxy", "xyyyyyx",
+    "yxxyyyy", "yxyxyyy",
+    "yxyyxyy", "yxyyyxy",
+    "yxyyyyx", "yyxxyyy",
+    "yyxyxyy", "yyxyyxy",
+    "yyxyyyx", "yyyxxyy",
+    "yyyxyxy", "yyyxyyx",
+    "yyyyxxy", "yyyyxyx",
+    "yyyyyxx",
+
+    "yyyyyyy"
+    ]
+coeff_m7=[1, 1, 1, 1, 1, 1, 1,
+
+          -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1,
+          -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1,
+
+          1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1,
+
+          -1
+          ]
+
+# Svetlichny measurements
+s3=["xxc", "xxd", "xyc", "yxc", "yyd", "yyc", "yxd", "xyd"]
+coeff_s3=[1, 1, 1, 1, -1, -1, -1, -1]
+
+#s4=["xxxx", "yxxx", "xyxx", "xxyx", "xxxy", "yyxx", "yxyx", "yxxy",
+#    "xyyx", "xyxy", "xxyy", "yyyx", "yyxy", "yxyy", "xyyy", "yyyy"
+#    ]
+s4=["yyyy", "xyyy", "yxyy", "yyxy", "yyyx", "xxyy", "xyxy", "xyyx",
+    "yxxy", "yxyx", "yyxx", "xxxy", "xxyx", "xyxx", "yxxx", "xxxx"
+    ]
+coeff_s4=[1, -1, -1, -1,
+          -1, -1, -1, -1,
+          -1, -1, -1, 1,
+          1, 1, 1, 1]
+
+# svetlichny5, svetlichny6, ..., mermin8, mermin9, ... are generated on first lookup (see correlators.py)
+correlator_dict = GeneratedTable({'mermin3': m3, 'mermin4': m4, 'mermin5': m5, 'mermin6': m6, 'mermin7': m7,
+                                   'svetlichny3': s3, 'svetlichny4': s4}, 0)
+coeff_dict = GeneratedTable({'mermin3': coeff_m3, 'mermin4': coeff_m4, 'mermin5': coeff_m5, 'mermin6': coeff_m6, 'mermin7': coeff_m7,
+                              'svetlichny3': coeff_s3, 'svetlichny4': coeff_s4}, 1)
+
 def measurements(string):
     """
-    :param string: Sequence of bases for measurements (e.g. XXY, YXYY, XXYYX)
+    :param string: Sequence of bases for measurements (e.g. XXY, YXYY, XXYYX), an entry
+                   can also be a (theta, phi) pair (any length 2 sequence) measuring along that
+                   Bloch sphere direction
     :return: qc: quantum circuit to project measurements into Y or X bases
     """
     qc = Circuit(len(string),len(string))
@@ -144,182 +288,490 @@ def measurements(string):
             qc.S(i)
             qc.H(i)
 
+        # arbitrary direction, angles in radians (pytket takes half-turns); any pair, so that
+        # bases read back from json (lists) work as well as tuples
+        elif not isinstance(string[i], str) and len(string[i]) == 2:
+            theta, phi = string[i]
+            qc.Rz(-phi/np.pi, i)
+            qc.Ry(-theta/np.pi, i)
+
         else:
-            print("ERROR! unrecognized symbol: ",string[i])
-            exit(1)
+            raise ValueError("unrecognized measurement basis: {!r}".format(string[i]))
 
     # barrier used to isolate sections which Pytket can optimize
     qc.add_barrier(range(0,len(string)))
 
     return qc
 
-def Inequality(ineq, qubit, device, rep, shots):
+def state_preparation(ineq, state_prep="star", coupling_map=None):
+    """
+    :param ineq: inequality and number of qubits, e.g. mermin3
+    :param state_prep: "star" for the hand written circuits above, "tree" for the log depth GHZ tree,
+                       "dynamic" for the constant depth GHZ with mid-circuit measurement and feed-forward
+    :param coupling_map: list of (a, b) physical qubit pairs the tree is built on, all-to-all if None
+    :return: qc: qiskit state preparation circuit, a pytket circuit for "dynamic" (conditional gates)
+    """
+    if state_prep == "star":
+        if ineq not in function_dict and ineq.startswith("svetlichny"):
+            return svet(len(correlator_dict[ineq][0]))
+        if ineq not in function_dict and ineq.startswith("mermin"):
+            return mermin(len(correlator_dict[ineq][0]))
+        return function_dict[ineq]()
+
+    if state_prep == "tree":
+        qubit = len(correlator_dict[ineq][0])
+        qc, layout = ghz_circuit(qubit, coupling_map, phase=ineq.startswith("mermin"))
+        return qc
+
+    if state_prep == "dynamic":
+        qubit = len(correlator_dict[ineq][0])
+        return dynamic_ghz_circuit(qubit, phase=ineq.startswith("mermin"))
+
+    print("ERROR! unrecognized state preparation: ", state_prep)
+    exit(1)
+
+def correlator_circuit(ineq, string, rep, state_prep="star", coupling_map=None, twirl=False):
+    """
+    Assembled from cached fragments: the converted state preparation, the
+    measurement layer of the basis string and the finished circuit are each
+    built once per process.
+
+    :param ineq: inequality and number of qubits, e.g. mermin3
+    :param string: Sequence of bases for measurements (e.g. XXY, YXYY, XXYYX)
+    :param rep: number of midcircuit measurements (state is re-prepared after a reset each time)
+    :param state_prep: see state_preparation
+    :param coupling_map: device coupling map; a tree GHZ is then placed on the physical qubits it was built for
+    :param twirl: put a symbolic flip (twirl.flip_layer) before every measurement
+    :return: d: circuit measuring qubit h of repetition r into bit h+(r*qubit)
+    """
+    variant = () if state_prep == "star" else (state_prep, None if coupling_map is None else tuple(coupling_map))
+
+    return fragments.get(('circuit', ineq, string, rep, 1) + variant + (('twirl',) if twirl else ()),
+                         lambda: _assemble(ineq, [string], rep, state_prep, coupling_map, variant, twirl))
+
+def interleaved_circuit(ineq, strings, rep, state_prep="star", coupling_map=None):
+    """
+    One circuit for a whole inequality: successive repetitions cycle through
+    the basis strings, so repetition r measures strings[r % len(strings)].
+
+    :param strings: Sequence of basis strings, e.g. correlator_dict[ineq]
+    :param rep: number of repetitions of every basis string
+    :return: d: circuit measuring qubit h of repetition r into bit h+(r*qubit), rep*len(strings) repetitions
+    """
+    variant = () if state_prep == "star" else (state_prep, None if coupling_map is None else tuple(coupling_map))
+
+    return fragments.get(('circuit', ineq, tuple(strings), rep, 1) + variant,
+                         lambda: _assemble(ineq, list(strings), rep * len(strings), state_prep, coupling_map,
+                                           variant))
+
+def parametric_circuit(ineq, rep, state_prep="star", coupling_map=None, twirl=False):
+    """
+    :return: d: like correlator_circuit, but measuring along the symbolic directions of parametric.rotation_layer
+    """
+    variant = () if state_prep == "star" else (state_prep, None if coupling_map is None else tuple(coupling_map))
+
+    return fragments.get(('circuit', ineq, None, rep, 1) + variant + (('twirl',) if twirl else ()),
+                         lambda: _assemble(ineq, None, rep, state_prep, coupling_map, variant, twirl))
+
+def compiled_template(backend, device, ineq, rep, state_prep="star", coupling_map=None, nodes=None, twirl=False):
+    """
+    :param nodes: physical qubits to place the circuit on (see place), the compiler's choice if None
+    :param twirl: keep the symbolic flips of twirl.flip_layer, too
+    :return: parametric_circuit compiled for the device, once per process
+    """
+    variant = () if state_prep == "star" else (state_prep, None if coupling_map is None else tuple(coupling_map))
+    if nodes is not None:
+        variant += (tuple(nodes),)
+    if twirl:
+        variant += ('twirl',)
+
+    def build():
+        d = parametric_circuit(ineq, rep, state_prep, coupling_map, twirl)
+        return backend.get_compiled_circuit(place(d, nodes), optimisation_level=2)
+
+    return fragments.get(('compiled', device, ineq, rep) + variant, build)
+
+def place(d, nodes):
+    """
+    :param d: circuit on Qubit(0), Qubit(1), ...
+    :param nodes: physical qubit of every circuit qubit, or None
+    :return: d, with qubit i renamed to Node(nodes[i]); the compiler keeps placed qubits
+    """
+    if nodes is not None:
+        d.rename_units({Qubit(i): Node(q) for i, q in enumerate(nodes)})
+
+    return d
+
+def _coupling_map(backend, state_prep):
+    """
+    :return: physical couplings for the tree state preparation, None (all-to-all) on simulators
+    """
+    if state_prep != "tree":
+        return None
+
+    architecture = backend.backend_info.architecture
+    if architecture is not None and getattr(architecture, "coupling", None):
+        return sorted((a.index[0], b.index[0]) for a, b in architecture.coupling)
+
+    return None
+
+def _assemble(ineq, strings, rep, state_prep, coupling_map, variant, twirl=False):
+    """
+    :param strings: basis strings measured by successive repetitions (cycled), or None for the parametric layer
+    :param twirl: add the symbolic flips of twirl.flip_layer before the measurements
+    """
+    qubit = len(correlator_dict[ineq][0])
+
+    def convert():
+        qc = state_preparation(ineq, state_prep, coupling_map)
+        if isinstance(qc, Circuit):
+            return qc
+        with tracer.span("conversion", ineq=ineq, state_prep=state_prep):
+            return qiskit_to_tk(qc)
+
+    state = fragments.get(('state', ineq, 1) + variant, convert)
+    if strings is None:
+        layers = [fragments.get(('basis', None, qubit), lambda: rotation_layer(qubit))]
+    else:
+        layers = [fragments.get(('basis', string, 1), lambda: measurements(string)) for string in strings]
+    d = Circuit(0,rep*qubit)
+
+    for r in range(0,rep):
+        d.append(state)
+        d.append(layers[r % len(layers)])
+        if twirl:
+            d.append(fragments.get(('flip', qubit, r), lambda: flip_layer(qubit, r)))
+
+        # need to specify which measurements go where!
+        for h in range(0,qubit):
+            d.Measure(h,h+(r*qubit))
+
+        if (r<rep-1):
+            d.add_barrier(range(0, qubit))
+            for z in range(0,qubit):
+                d.add_gate(OpType.Reset, [z])
+
+    # pin the tree to the physical qubits it was scheduled on, the compiler keeps placed qubits
+    if state_prep == "tree" and coupling_map is not None:
+        layout = ghz_schedule(qubit, coupling_map)[0]
+        d.rename_units({Qubit(i): Node(q) for i, q in enumerate(layout)})
+
+    return d
+
+def Inequality(ineq, qubit, device, rep, shots, mitigate=False, archive=None, memory=False, state_prep="star",
+               parametric=False, budget=None, placement=None, interleave=False, twirl=0, zne=None):
     """
     Add documentation here
+    :param mitigate: apply tensored readout error mitigation, calibrating the used qubits if needed
+    :param archive: directory of the results archive to store the raw counts in, or None
+    :param memory: analyse the per-shot memory in fixed size chunks instead of building counts
+    :param device: device name, or "auto" for the device with the lowest expected time to result
+    :param state_prep: "star" (fan out from qubit 0), "tree" (log depth GHZ on the device's coupling map)
+                       or "dynamic" (constant depth GHZ with mid-circuit measurement, needs a dynamic circuit backend)
+    :param parametric: compile one circuit with a symbolic measurement layer and bind every correlator's bases
+    :param budget: QPU seconds the run may take, it is rejected before submission if the estimate is higher
+    :param placement: "noise" to place the circuits on the connected qubits with the lowest calibrated
+                      CNOT, readout and reset error (see layout.py), the compiler's choice if None
+    :param interleave: a single circuit whose repetitions cycle through all correlators, rep times each
+    :param twirl: run every correlator as this many instances with random readout flips (see twirl.py), the
+                  shots split between them and the flips undone in the analysis; 0 for plain readout
+    :param zne: odd noise scale factors, e.g. (1, 3, 5), to fold the compiled circuits by and extrapolate the
+                value to zero noise (see zne.py); None for no extrapolation
     :return: expectation: experimental bell-type inequality value
     """
 
     ineq=ineq.lower() + str(qubit)
 
-    function_dict = {'mermin3': mermin3, 'mermin4': mermin4, 'mermin5': mermin5, 'mermin6': mermin6, 'mermin7': mermin7,
-                     'svetlichny3': svet3, 'svetlichny4': svet4}
-
-    state=qiskit_to_tk( function_dict[ineq]() ).copy()
-
-    # Mermin measurements for iGHZ state.
-    m3=["xxy", "xyx", "yxx", "yyy"]
-    coeff_m3= [1.0, 1.0, 1.0, -1.0]
-    m4=["xxxy", "xxyx", "xyxx", "yxxx", "xyyy", "yxyy", "yyxy", "yyyx"]
-    coeff_m4=[1, 1, 1, 1, -1, -1, -1, -1]
-    m5=["xxxxy", "xxxyx", "xxyxx", "xyxxx", "yxxxx",   "xxyyy", "xyyxy", "xyyyx", "xyxyy", "yyyxx", "yyxyx", "yyxxy", "yxyyx", "yxyxy", "yxxyy", "yyyyy"]
-    coeff_m5=[1, 1, 1, 1, 1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, 1]
-    m6=["xxxxxy", "xxxxyx", "xxxyxx", "xxyxxx", "xyxxxx", "yxxxxx",
-
-        "xxxyyy","xxyxyy",
-        "xxyyxy","xxyyyx",
-        "xyxxyy","xyxyxy",
-        "xyxyyx","xyyxxy",
-        "xyyxyx","xyyyxx",
-        "yxxxyy","yxxyxy",
-        "yxxyyx","yxyxxy",
-        "yxyxyx","yxyyxx",
-        "yyxxxy","yyxxyx",
-        "yyxyxx","yyyxxx",
-
-        "yyyyyx", "yyyyxy", "yyyxyy", "yyxyyy", "yxyyyy", "xyyyyy"]
-    coeff_m6=[1, 1, 1, 1, 1, 1,
-              -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1,
-             1, 1, 1, 1, 1, 1]
-    m7=["xxxxxxy", "xxxxxyx", "xxxxyxx", "xxxyxxx", "xxyxxxx", "xyxxxxx", "yxxxxxx",
-
-        # 35 with 3 y's
-        "xxxxyyy", "xxxyxyy",
-        "xxxyyxy", "xxxyyyx",
-        "xxyxxyy", "xxyxyxy",
-        "xxyxyyx", "xxyyxxy",
-        "xxyyxyx", "xxyyyxx",
-        "xyxxxyy", "xyxxyxy",
-        "xyxxyyx", "xyxyxxy",
-        "xyxyxyx", "xyxyyxx",
-        "xyyxxxy", "xyyxxyx",
-        "xyyxyxx", "xyyyxxx",
-        "yxxxxyy", "yxxxyxy",
-        "yxxxyyx", "yxxyxxy",
-        "yxxyxyx", "yxxyyxx",
-        "yxyxxxy", "yxyxxyx",
-        "yxyxyxx", "yxyyxxx",
-        "yyxxxxy", "yyxxxyx",
-        "yyxxyxx", "yyxyxxx",
-        "yyyxxxx",
-
-        # 21 with 5 y's
-        "xxyyyyy", "xyxyyyy",
-        "xyyxyyy", "xyyyxyy",
-        "xyyyyxy", "xyyyyyx",
-        "yxxyyyy", "yxyxyyy",
-        "yxyyxyy", "yxyyyxy",
-        "yxyyyyx", "yyxxyyy",
-        "yyxyxyy", "yyxyyxy",
-        "yyxyyyx", "yyyxxyy",
-        "yyyxyxy", "yyyxyyx",
-        "yyyyxxy", "yyyyxyx",
-        "yyyyyxx",
-
-        "yyyyyyy"
-        ]
-    coeff_m7=[1, 1, 1, 1, 1, 1, 1,
-
-              -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1,
-              -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1,
-
-              1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1,
-
-              -1
-              ]
-
-    # Svetlichny measurements
-    s3=["xxc", "xxd", "xyc", "yxc", "yyd", "yyc", "yxd", "xyd"]
-    coeff_s3=[1, 1, 1, 1, -1, -1, -1, -1]
-
-    #s4=["xxxx", "yxxx", "xyxx", "xxyx", "xxxy", "yyxx", "yxyx", "yxxy",
-    #    "xyyx", "xyxy", "xxyy", "yyyx", "yyxy", "yxyy", "xyyy", "yyyy"
-    #    ]
-    s4=["yyyy", "xyyy", "yxyy", "yyxy", "yyyx", "xxyy", "xyxy", "xyyx",
-        "yxxy", "yxyx", "yyxx", "xxxy", "xxyx", "xyxx", "yxxx", "xxxx"
-        ]
-    coeff_s4=[1, -1, -1, -1,
-              -1, -1, -1, -1,
-              -1, -1, -1, 1,
-              1, 1, 1, 1]
-
-    correlator_dict = {'mermin3': m3, 'mermin4': m4, 'mermin5': m5, 'mermin6': m6, 'mermin7': m7,
-                     'svetlichny3': s3, 'svetlichny4': s4}
-    coeff_dict = {'mermin3': coeff_m3, 'mermin4': coeff_m4, 'mermin5': coeff_m5, 'mermin6': coeff_m6, 'mermin7': coeff_m7,
-                     'svetlichny3': coeff_s3, 'svetlichny4': coeff_s4}
-
-
-    # list of circuits to be compiled and run
-    circ_list=[]
-
-    # append measurements in x/y bases
-    # also do repetitions based on number of midcicuit measurements requested
-    for m in correlator_dict[ineq]:
-
-        c = state.copy()
-        c.append(measurements(m))
-        d = Circuit(0,rep*qubit)
-
-        for r in range(0,rep):
-            d.append(c)
-
-            # need to specify which measurements go where!
-            for h in range(0,qubit):
-                d.Measure(h,h+(r*qubit))
-
-            if (r<rep-1):
-                d.add_barrier(range(0, qubit))
-                for z in range(0,qubit):
-                    d.add_gate(OpType.Reset, [z])
-
-        circ_list.append(d)
-        print(tk_to_qiskit(d))
+    # queue aware choice among the provider's devices
+    if device == "auto":
+        device = select_device(get_provider(), qubit, len(correlator_dict[ineq]) * len(zne or [1]), shots, rep,
+                               dynamic=state_prep == "dynamic")
+        print("selected device: ", device)
 
     # does this work for simulators as well? Could be useful to check optimal results.
-    backend = IBMQBackend(device)
+    backend = get_backend(device)
+
+    coupling_map = _coupling_map(backend, state_prep)
+
+    # noise aware placement: a tree is scheduled on the chosen qubits only, other preparations are renamed onto them
+    nodes = None
+    if placement == "noise":
+        nodes, cost = device_layout(device, qubit, rep)
+        print("placed on qubits: ", nodes, " cost: ", cost)
+        if coupling_map is not None:
+            coupling_map = [(a, b) for a, b in coupling_map if a in nodes and b in nodes]
+            nodes = None
+
+    attributes = {'ineq': ineq, 'n': qubit, 'rep': rep, 'shots': shots,
+                  'circuits': (1 if interleave else len(correlator_dict[ineq])) * max(twirl, 1) * len(zne or [1])}
+
+    if parametric and interleave:
+        raise ValueError("interleave needs the fixed measurement layers, not the parametric one")
+    if twirl and (mitigate or memory or interleave):
+        raise ValueError("twirl cannot be combined with mitigate, memory or interleave")
+    if twirl > shots:
+        raise ValueError("twirl needs at least one shot per instance")
+    if zne and (twirl or interleave):
+        raise ValueError("zne cannot be combined with twirl or interleave")
+
+    # the twirled instances share the shots of their correlator
+    n_shots = shots // twirl if twirl else shots
+    masks = flip_masks(twirl, rep * qubit) if twirl else None
+
+    if parametric:
+        start = time.time()
+        with tracer.span("compile", parametric=True, **attributes):
+            template = compiled_template(backend, device, ineq, rep, state_prep, coupling_map, nodes, bool(twirl))
+            if twirl:
+                circ_list = [c for m in correlator_dict[ineq] for c in instances(template, masks, bindings(m))]
+            else:
+                circ_list = [bind(template, m) for m in correlator_dict[ineq]]
+        print("parametric circuit compiled and bound in : ", time.time() - start, " seconds")
+    else:
+        # list of circuits to be compiled and run
+        circ_list=[]
+
+        # append measurements in x/y bases
+        # also do repetitions based on number of midcicuit measurements requested
+        with tracer.span("construction", **attributes):
+            if interleave:
+                circ_list.append(place(interleaved_circuit(ineq, correlator_dict[ineq], rep, state_prep, coupling_map),
+                                       nodes))
+
+            for m in ([] if interleave else correlator_dict[ineq]):
+
+                d = place(correlator_circuit(ineq, m, rep, state_prep, coupling_map, bool(twirl)), nodes)
+                circ_list.append(d)
+                print(tk_to_qiskit(d))
+
+        start = time.time()
+        print("compiling circuits...")
+        with tracer.span("compile", **attributes):
+            circ_list = backend.get_compiled_circuits(circ_list, optimisation_level=2)
+        end = time.time()
+        print("compilation finished in : ", end - start, " seconds")
+
+        # the compiled circuits are templates, every instance only binds its flips
+        if twirl:
+            with tracer.span("twirl", instances=twirl, **attributes):
+                circ_list = [c for template in circ_list for c in instances(template, masks)]
+
+    # every scale factor is folded from the same compiled circuits, scale major
+    if zne:
+        with tracer.span("fold", scales=list(zne), **attributes):
+            circ_list = [fold(c, scale) for scale in zne for c in circ_list]
+
+    # readout calibration circuits run in the same batch, unless the qubits have a recent enough calibration
+    cal_list = []
+    matrices = None
+    if mitigate:
+        # every repetition is looked up, the compiler may route a later one onto other qubits
+        n_data = rep * qubit * (len(correlator_dict[ineq]) if interleave else 1)
+        layouts = [measured_qubits(circ, n_data) for circ in circ_list]
+        physical = sorted(set(q for layout in layouts for q in layout))
+
+        matrices = calibration_cache.get(device, physical)
+        if matrices is None:
+            cal_list = calibration_circuits([Node(q) for q in physical])
+            cal_list = backend.get_compiled_circuits(cal_list, optimisation_level=0)
+
+    if budget is not None:
+        cost = estimate(circ_list + cal_list, n_shots, device_timings(device))
+        print("estimated cost: ", cost.summary())
+        enforce(cost, seconds=budget)
+
+    with tracer.span("submit", calibration=len(cal_list), **attributes):
+        handle_list = backend.process_circuits(circ_list + cal_list, n_shots=n_shots)
+    result_list = wait_for_results(backend, handle_list, tracer, **attributes)
+
+    if cal_list:
+        zero, one = result_list[-2:]
+        result_list = result_list[:-2]
+        matrices = assignment_matrices(zero.get_counts(), one.get_counts())
+        calibration_cache.update(device, physical, matrices)
+
+    # the matrices looked up at submission (or calibrated in this batch), even if the cache entry expired in the queue
+    bit_matrices = None
+    if mitigate:
+        calibrated = dict(zip(physical, matrices))
+        bit_matrices = [np.array([calibrated[q] for q in layout]) for layout in layouts]
+
+    if archive is not None:
+        spec = {'ineq': ineq, 'qubit': qubit, 'device': device, 'rep': rep, 'shots': shots,
+                'correlators': correlator_dict[ineq], 'coeffs': coeff_dict[ineq], 'interleave': interleave,
+                'twirl': None if masks is None else masks.tolist(), 'zne': None if zne is None else list(zne)}
+        with tracer.span("archive", **attributes):
+            print("archived to: ", save_run(archive, spec, circ_list, result_list, memory=memory))
+
+    with tracer.span("analysis", memory=memory, mitigate=mitigate, **attributes):
+        if twirl:
+            return _analyse_twirled(ineq, qubit, rep, result_list, masks)
+        if zne:
+            return _analyse_zne(ineq, qubit, rep, shots, result_list, memory, bit_matrices, zne)
+        if interleave:
+            return _analyse_interleaved(ineq, qubit, rep, result_list[0], memory,
+                                        None if bit_matrices is None else bit_matrices[0])
+        return _analyse(ineq, qubit, rep, result_list, memory, bit_matrices)
+
+def _analyse_interleaved(ineq, qubit, rep, result, memory, matrices):
+    """
+    :param matrices: (rep*len(correlators)*qubit, 2, 2) assignment matrices of the measured qubits, None unmitigated
+    :return: expectation: bell-type inequality value of the single interleaved circuit, repetition
+             r holds correlator r % len(correlator_dict[ineq])
+    """
+    n_corr = len(correlator_dict[ineq])
+    data_bits = [Bit(i) for i in range(rep * n_corr * qubit)]
+
+    if memory:
+        weights = None if matrices is None else parity_weights(matrices)
+        accumulator = ParityAccumulator(1, qubit, rep * n_corr)
+        accumulator.consume(0, result_chunks(result, cbits=data_bits), weights)
+        values = accumulator.expectations().reshape(rep, n_corr).mean(axis=0)
+    else:
+        counts = PackedCounts.from_counts(result.get_counts(cbits=data_bits))
+
+        if matrices is not None:
+            values = []
+            for j in range(n_corr):
+                bits = [h + (r*n_corr + j)*qubit for r in range(rep) for h in range(qubit)]
+                values.append(mitigated_expectation(counts.select(bits), qubit, matrices[bits]))
+        else:
+            values = counts.block_expectations(qubit).reshape(rep, n_corr).mean(axis=0)
+
+    expectation = 0
+    for coeff, value, m in zip(coeff_dict[ineq], values, correlator_dict[ineq]):
+        expectation += coeff * value
+        print(value, coeff, m)
+
+    return expectation
+
+def _analyse_twirled(ineq, qubit, rep, result_list, masks):
+    """
+    :param masks: flip masks of the instances, result j*len(masks)+i is instance i of correlator j
+    :return: expectation: bell-type inequality value, with the readout flips undone
+    """
+    data_bits = [Bit(i) for i in range(rep * qubit)]
+
+    expectation = 0
+    for j, (coeff, m) in enumerate(zip(coeff_dict[ineq], correlator_dict[ineq])):
+        results = result_list[j * len(masks):(j + 1) * len(masks)]
+        counts = untwirl([PackedCounts.from_counts(r.get_counts(cbits=data_bits)) for r in results], masks)
+
+        value = counts.block_expectations(qubit).mean()
+        expectation += coeff * value
+        print(value, coeff, m)
+
+    return expectation
 
-    start = time.time()
-    print("compiling circuits...")
-    circ_list = backend.get_compiled_circuits(circ_list, optimisation_level=2)
-    end = time.time()
-    print("compilation finished in : ", end - start, " seconds")
+def _analyse_zne(ineq, qubit, rep, shots, result_list, memory, matrices, scales):
+    """
+    :param matrices: assignment matrices of the bits of every circuit, None unmitigated
+    :param scales: noise scale factors, result s*len(correlators)+j is correlator j folded by scales[s]
+    :return: expectation: bell-type inequality value extrapolated to zero noise
+    """
+    data_bits = [Bit(i) for i in range(rep * qubit)]
+
+    if memory:
+        accumulator = ParityAccumulator(len(result_list), qubit, rep)
+        for i, result in enumerate(result_list):
+            weights = None if matrices is None else parity_weights(matrices[i])
+            accumulator.consume(i, result_chunks(result, cbits=data_bits), weights)
+        values = accumulator.expectations().mean(axis=1)
+    else:
+        values = np.zeros(len(result_list))
+        for i, result in enumerate(result_list):
+            counts = PackedCounts.from_counts(result.get_counts(cbits=data_bits))
+            if matrices is not None:
+                values[i] = mitigated_expectation(counts, qubit, matrices[i])
+            else:
+                values[i] = counts.block_expectations(qubit).mean()
+
+    expectation, error, per_scale = zero_noise(scales, values.reshape(len(scales), -1), coeff_dict[ineq], shots * rep)
+    for scale, value in zip(scales, per_scale):
+        print("scale factor ", scale, ": ", value)
+    print("extrapolated to zero noise: ", expectation, " +- ", error)
+
+    return expectation
 
-    handle_list = backend.process_circuits(circ_list, n_shots=shots)
-    result_list = backend.get_results(handle_list)
+def _analyse(ineq, qubit, rep, result_list, memory, matrices):
+    """
+    :param matrices: assignment matrices of the bits of every circuit, None unmitigated
+    :return: expectation: bell-type inequality value of the results of Inequality()
+    """
+    # the dynamic preparation also writes its fusion measurements, only the "c" register is data
+    data_bits = [Bit(i) for i in range(rep * qubit)]
 
     expectation = 0
 
-    for coeff, result in zip(coeff_dict[ineq], result_list):
+    if memory:
+        accumulator = ParityAccumulator(len(result_list), qubit, rep)
 
-        counts = result.get_counts()
-        d = collections.Counter()
+        for j, result in enumerate(result_list):
+            weights = None if matrices is None else parity_weights(matrices[j])
+            accumulator.consume(j, result_chunks(result, cbits=data_bits), weights)
 
-        for i in counts:
-            val = i
-            count = counts[i]
+        for coeff, value in zip(coeff_dict[ineq], accumulator.expectations().mean(axis=1)):
+            expectation += coeff * value
+            print(value, coeff)
 
-            # split the tuple into qubit(=3 now) pieces
-            val = tuple(val[x:x + qubit]
-                        for x in range(0, len(val), qubit))
+        return expectation
 
-            for k in range(0, len(val)):
-                d[val[k]] = d[val[k]] + count
+    for j, (coeff, result) in enumerate(zip(coeff_dict[ineq], result_list)):
 
-        expectation += coeff * expectation_from_counts(d)
+        counts = PackedCounts.from_counts(result.get_counts(cbits=data_bits))
+
+        if matrices is not None:
+            value = mitigated_expectation(counts, qubit, matrices[j])
+        else:
+            # every qubit sized block is one repetition, all with the same number of shots
+            value = counts.block_expectations(qubit).mean()
+
+        expectation += coeff * value
         # also print out the correlator string here for clarity
-        print(expectation_from_counts(d), coeff)
+        print(value, coeff)
 
     return expectation
 
+def correlator_values(ineq, qubit, device, rep, shots, bases, state_prep="star"):
+    """
+    Correlators for arbitrary measurement directions, e.g. for angle scans: the
+    parametric circuit is compiled once per device and only bound per basis.
+
+    :param bases: list of bases, each a basis string or a (theta, phi) pair per qubit (see parametric.basis_angles)
+    :return: array of correlator values, one per basis
+    """
+    ineq = ineq.lower() + str(qubit)
+    backend = get_backend(device)
+    coupling_map = _coupling_map(backend, state_prep)
+
+    template = compiled_template(backend, device, ineq, rep, state_prep, coupling_map)
+    handle_list = backend.process_circuits([bind(template, basis) for basis in bases], n_shots=shots)
+
+    data_bits = [Bit(i) for i in range(rep * qubit)]
+
+    return np.array([PackedCounts.from_counts(result.get_counts(cbits=data_bits)).block_expectations(qubit).mean()
+                     for result in backend.get_results(handle_list)])
+
+def validate_state_prep(ineq, qubit, state_prep, rep=1, shots=16384, device="aer_simulator", sigmas=5):
+    """
+    Runs a state preparation on a noiseless simulator and checks the measured
+    value against the ideal one (ideal.ideal_value), within the shot noise.
+
+    :param state_prep: see state_preparation
+    :param sigmas: accepted deviation, in standard deviations of the shot noise bound
+    :return: measured, ideal, ok
+    """
+    name = ineq.lower() + str(qubit)
+    phase = np.pi / 2 if name.startswith("mermin") else 0.0
+    ideal = ideal_value(correlator_dict[name], coeff_dict[name], phase)
+
+    measured = Inequality(ineq, qubit, device, rep, shots, state_prep=state_prep)
+
+    # every correlator is a mean of rep*shots values in [-1, 1]
+    bound = np.sqrt(np.sum(np.square(coeff_dict[name])) / (rep * shots))
+
+    return measured, ideal, abs(measured - ideal) <= sigmas * bound
+
 if __name__ == "__main__":
 
     # Experimentally computed inequality value
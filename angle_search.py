@@ -0,0 +1,199 @@
+import time
+import numpy as np
+
+# Offline search for the measurement angles of the largest Bell violation
+# under a noise model.
+#
+# The noisy state is a GHZ state with relative phase alpha (pi/2 for the
+# Mermin iGHZ state, 0 for GHZ+), mixed with the maximally mixed state
+# (depolarizing probability p) and with its |0..0><1..1| coherence scaled by
+# c (dephasing). Every qubit is then read out with its own assignment matrix.
+# For such a state every product correlator has a closed form: with
+# measurement directions (theta_q, phi_q) and a noisy readout that reports
+# u_q + v_q * s for a true outcome s = +-1,
+#
+#     <prod o_q> = p prod(u) + (1-p)/2 [prod(u + v cos theta) + prod(u - v cos theta)]
+#                + (1-p) c prod(v sin theta) cos(sum(phi) - alpha)
+#
+# so a whole batch of candidate angle sets is a few array products, no
+# density matrix is ever built, and thousands of candidates cost
+# milliseconds.
+
+# CHSH on the Bell state, in the same alphabet: Alice measures x/y, Bob c/d
+CHSH_CORRELATORS = ['xc', 'xd', 'yc', 'yd']
+CHSH_COEFFS = [1, 1, 1, -1]
+
+
+class NoiseSnapshot:
+    """
+    Noise parameters of an n qubit GHZ experiment.
+    """
+
+    def __init__(self, n, depolarizing=0.0, coherence=1.0, readout=None):
+        """
+        :param n: number of qubits
+        :param depolarizing: probability p of the state being replaced by the maximally mixed state
+        :param coherence: factor c on the GHZ coherence, 1 without dephasing
+        :param readout: (n, 2, 2) assignment matrices A[q, measured, prepared], ideal if None
+        """
+        self.n = n
+        self.depolarizing = depolarizing
+        self.coherence = coherence
+        self.readout = np.tile(np.eye(2), (n, 1, 1)) if readout is None else np.asarray(readout, dtype=float)
+
+        # E[reported value | true outcome s] = u + v * s, with s = +1 for |0>
+        flip0 = self.readout[:, 1, 0]
+        flip1 = self.readout[:, 0, 1]
+        self.u = flip1 - flip0
+        self.v = 1 - flip0 - flip1
+
+    @classmethod
+    def from_backend_info(cls, info, n, nodes=None, coherence=1.0):
+        """
+        Snapshot from a pytket BackendInfo: symmetric readout errors from
+        averaged_readout_errors, and a depolarizing probability from the n-1
+        CNOTs of the GHZ preparation at the median two qubit gate error.
+
+        :param info: pytket BackendInfo (e.g. backend_pool.pytket_pool.info(device, 'backend_info'))
+        :param n: number of qubits
+        :param nodes: physical qubits of the experiment, the best n by readout error if None
+        :param coherence: factor on the GHZ coherence
+        :return: NoiseSnapshot
+        """
+        readout_errors = getattr(info, 'averaged_readout_errors', None) or {}
+        edge_errors = getattr(info, 'averaged_edge_gate_errors', None) or {}
+
+        if nodes is None:
+            nodes = sorted(readout_errors, key=readout_errors.get)[:n]
+        errors = [readout_errors.get(node, 0.0) for node in nodes] + [0.0] * (n - len(nodes))
+        readout = np.array([[[1 - e, e], [e, 1 - e]] for e in errors])
+
+        cx_error = float(np.median(list(edge_errors.values()))) if edge_errors else 0.0
+        depolarizing = 1 - (1 - cx_error) ** (n - 1)
+
+        return cls(n, depolarizing, coherence, readout)
+
+    def correlators(self, theta, phi, phase):
+        """
+        :param theta: (..., n) array of polar angles, one per qubit
+        :param phi: (..., n) array of azimuthal angles
+        :param phase: relative phase alpha of the GHZ state
+        :return: (...) array of measured product expectations
+        """
+        p, u, v = self.depolarizing, self.u, self.v
+        w = v * np.cos(theta)
+
+        populations = 0.5 * (np.prod(u + w, axis=-1) + np.prod(u - w, axis=-1))
+        coherence = self.coherence * np.prod(v * np.sin(theta), axis=-1) * np.cos(phi.sum(axis=-1) - phase)
+
+        return p * np.prod(u) + (1 - p) * (populations + coherence)
+
+
+def settings_of(correlators):
+    """
+    :param correlators: list of basis strings of one inequality
+    :return: settings, index: sorted list of (qubit, symbol) pairs that occur, and a
+             (n_correlators, n) array with the setting index of every qubit of every correlator
+    """
+    settings = sorted(set((q, b) for string in correlators for q, b in enumerate(string)))
+    position = {s: i for i, s in enumerate(settings)}
+    index = np.array([[position[(q, b)] for q, b in enumerate(string)] for string in correlators])
+
+    return settings, index
+
+
+def evaluate(angles, index, coeffs, noise, phase):
+    """
+    :param angles: (candidates, n_settings, 2) array of (theta, phi) per setting
+    :param index: setting index array from settings_of
+    :param coeffs: coefficients of the correlators
+    :param noise: NoiseSnapshot
+    :param phase: relative phase of the GHZ state
+    :return: (candidates,) array of inequality values
+    """
+    theta = angles[:, index, 0]
+    phi = angles[:, index, 1]
+
+    return noise.correlators(theta, phi, phase) @ np.asarray(coeffs, dtype=float)
+
+
+def _normalised(theta, phi):
+    """
+    :return: the same direction with theta in [0, pi] and phi in [0, 2 pi)
+    """
+    theta = theta % (2 * np.pi)
+    if theta > np.pi:
+        theta, phi = 2 * np.pi - theta, phi + np.pi
+
+    return float(theta), float(phi % (2 * np.pi))
+
+
+class SearchResult:
+
+    def __init__(self, value, settings, angles, correlators, evaluated, seconds):
+        self.value = value
+        self.settings = dict(zip(settings, (_normalised(theta, phi) for theta, phi in angles)))
+        self.correlators = correlators
+        self.evaluated = evaluated
+        self.seconds = seconds
+
+    def bases(self):
+        """
+        :return: one list of (theta, phi) per qubit for every correlator, for measurements() or correlator_values()
+        """
+        return [[self.settings[(q, b)] for q, b in enumerate(string)] for string in self.correlators]
+
+    def to_dict(self):
+        """
+        :return: json serialisable dict with the value, the correlators and their bases
+        """
+        return {'value': self.value, 'correlators': self.correlators, 'bases': self.bases(),
+                'evaluated': self.evaluated, 'seconds': self.seconds}
+
+    def rate(self):
+        """
+        :return: candidate angle sets evaluated per second
+        """
+        return self.evaluated / self.seconds if self.seconds else float('inf')
+
+
+def search(correlators, coeffs, noise, phase=0.0, samples=4096, rounds=40, keep=64, seed=None):
+    """
+    Random search followed by rounds of perturbing the best candidates with a
+    shrinking step. The sign of the violation does not matter, |value| is maximised.
+
+    :param correlators: list of basis strings, the symbols only name the settings
+    :param coeffs: their coefficients
+    :param noise: NoiseSnapshot with noise.n == len(correlators[0])
+    :param phase: relative phase of the GHZ state, pi/2 for the Mermin tests
+    :param samples: candidates evaluated per round
+    :param rounds: refinement rounds
+    :param keep: candidates kept between rounds
+    :param seed: random seed
+    :return: SearchResult
+    """
+    rng = np.random.default_rng(seed)
+    settings, index = settings_of(correlators)
+    start = time.time()
+
+    # start on the equator, where the GHZ correlations live, plus uniform directions
+    candidates = np.stack([np.where(rng.random((samples, len(settings))) < 0.5, np.pi / 2,
+                                    np.arccos(rng.uniform(-1, 1, (samples, len(settings))))),
+                           rng.uniform(0, 2 * np.pi, (samples, len(settings)))], axis=-1)
+    values = np.abs(evaluate(candidates, index, coeffs, noise, phase))
+    evaluated = samples
+
+    step = 0.5
+    for _ in range(rounds):
+        best = candidates[np.argsort(values)[-keep:]]
+        trial = best[rng.integers(keep, size=samples)] + rng.normal(0, step, (samples, len(settings), 2))
+
+        candidates = np.concatenate([best, trial])
+        values = np.abs(evaluate(candidates, index, coeffs, noise, phase))
+        evaluated += samples
+        step *= 0.85
+
+    winner = candidates[np.argmax(values)]
+    value = float(evaluate(winner[None], index, coeffs, noise, phase)[0])
+
+    return SearchResult(value, settings, winner, list(correlators), evaluated, time.time() - start)
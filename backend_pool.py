@@ -0,0 +1,165 @@
+import threading
+import time
+
+# One warm backend per device name, shared by every experiment in the process.
+#
+# Constructing an IBMQBackend (or fetching a qiskit backend from the provider)
+# authenticates and downloads the backend configuration and properties. The
+# pool does that once per device, and keeps anything read through info() for
+# ttl seconds, so repeated Inequality() calls skip the startup cost. The
+# factory is a plain callable device -> backend, so a local fake provider can
+# stand in for IBMQ.
+
+
+# device names served by a local simulator, without touching IBMQ
+LOCAL_DEVICES = ("aer", "aer_simulator", "local")
+
+
+def _pytket_factory(device):
+    """
+    :param device: device name, e.g. ibm_oslo, or one of LOCAL_DEVICES
+    :return: pytket IBMQBackend for the device, or AerBackend for a local device
+    """
+    if device in LOCAL_DEVICES:
+        from pytket.extensions.qiskit import AerBackend
+
+        return AerBackend()
+
+    from pytket.extensions.qiskit import IBMQBackend
+
+    return IBMQBackend(device)
+
+
+_provider = None
+
+
+def _qiskit_factory(device):
+    """
+    :param device: device name, e.g. ibmq_quito, or one of LOCAL_DEVICES
+    :return: qiskit backend from the ibm-q provider, loading the account on first use
+    """
+    if device in LOCAL_DEVICES:
+        from qiskit import Aer
+
+        return Aer.get_backend('aer_simulator')
+
+    return get_provider().get_backend(device)
+
+
+def get_provider():
+    """
+    :return: the ibm-q provider, loading the account on first use
+    """
+    global _provider
+
+    if _provider is None:
+        from qiskit import IBMQ
+
+        IBMQ.load_account()
+        _provider = IBMQ.get_provider('ibm-q')
+
+    return _provider
+
+
+class BackendPool:
+    """
+    Registry of backends, one per device name.
+    """
+
+    def __init__(self, factory, ttl=900, clock=time.monotonic):
+        """
+        :param factory: callable taking a device name and returning a backend
+        :param ttl: seconds a value read through info() stays valid
+        :param clock: callable returning the current time in seconds
+        """
+        self.factory = factory
+        self.ttl = ttl
+        self.clock = clock
+        self._backends = {}
+        self._created = {}
+        self._info = {}
+        self._lock = threading.Lock()
+
+    def get(self, device, max_age=None):
+        """
+        :param device: device name
+        :param max_age: build the backend again if it is older than this many seconds, for what a backend
+                        only reads when it is built (a pytket backend's backend_info and its calibration)
+        :return: the pooled backend, created on first request
+        """
+        with self._lock:
+            stale = max_age is not None and device in self._backends and \
+                self.clock() - self._created[device] > max_age
+            if device not in self._backends or stale:
+                self._backends[device] = self.factory(device)
+                self._created[device] = self.clock()
+                # values read from the old backend are dropped with it
+                for key in [k for k in self._info if k[0] == device]:
+                    del self._info[key]
+            return self._backends[device]
+
+    def created(self, device):
+        """
+        :param device: device name
+        :return: clock time the pooled backend was built, None if it is not in the pool
+        """
+        with self._lock:
+            return self._created.get(device)
+
+    def info(self, device, name):
+        """
+        Cached backend attribute (e.g. backend_info, configuration, properties).
+        Methods are called without arguments.
+
+        :param device: device name
+        :param name: attribute of the backend to read
+        :return: the value, refetched once it is older than ttl
+        """
+        backend = self.get(device)
+
+        with self._lock:
+            cached = self._info.get((device, name))
+            if cached is not None and self.clock() - cached[0] < self.ttl:
+                return cached[1]
+
+        value = getattr(backend, name)
+        if callable(value):
+            value = value()
+
+        with self._lock:
+            self._info[(device, name)] = (self.clock(), value)
+
+        return value
+
+    def evict(self, device):
+        """
+        Drop a device and everything cached for it, e.g. after its session expired.
+
+        :param device: device name
+        """
+        with self._lock:
+            self._backends.pop(device, None)
+            self._created.pop(device, None)
+            for key in [k for k in self._info if k[0] == device]:
+                del self._info[key]
+
+
+# process wide pools, for pytket and plain qiskit backends
+pytket_pool = BackendPool(_pytket_factory)
+qiskit_pool = BackendPool(_qiskit_factory)
+
+
+def get_backend(device):
+    """
+    :param device: device name
+    :return: pooled pytket backend
+    """
+    return pytket_pool.get(device)
+
+
+def get_qiskit_backend(device):
+    """
+    :param device: device name
+    :return: pooled qiskit backend
+    """
+    return qiskit_pool.get(device)
@@ -0,0 +1,311 @@
+"""
+Command line entry point for the Bell inequality experiments.
+
+    python bell.py run mermin --n 5 --device ibm_oslo --rep 2 --shots 8192
+    python bell.py run svetlichny --n 3 --device aer_simulator
+    python bell.py run chsh --device ibmq_quito --thetas 15 --plot chsh.png
+    python bell.py plot results/*.json --format svg --jobs 8
+    python bell.py sweep nightly.json
+
+Only the standard library is imported at start up. qiskit, pytket and the
+IBMQ extensions are loaded when an experiment actually runs, matplotlib only
+when a plot is requested, and IBMQ is never contacted for local devices.
+Plots are rendered headless from stored result files.
+"""
+import argparse
+import importlib.util
+import os
+import sys
+
+# experiment scripts, loaded on demand (their file names are not importable)
+SCRIPTS = {'inequality': 'Experimental Bell Inequalities.py',
+           'chsh': 'CHSH Qiskit Textbook.py'}
+
+# qubit counts each inequality has state preparations and correlators for
+SUPPORTED = {'mermin': range(3, 13),
+             'svetlichny': range(3, 9),
+             'chsh': range(2, 3)}
+
+_loaded = {}
+
+
+def load_script(name):
+    """
+    :param name: key of SCRIPTS
+    :return: the script, imported as a module (once per process)
+    """
+    if name not in _loaded:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), SCRIPTS[name])
+        spec = importlib.util.spec_from_file_location("bell_" + name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _loaded[name] = module
+
+    return _loaded[name]
+
+
+def validate(args):
+    """
+    Check an experiment spec without importing anything heavy.
+
+    :param args: parsed arguments of the run command
+    :return: list of error messages, empty if the spec is valid
+    """
+    errors = []
+
+    qubits = SUPPORTED[args.ineq]
+    if args.ineq == 'chsh':
+        if args.n is not None and args.n != 2:
+            errors.append("chsh always uses 2 qubits")
+    elif args.n not in qubits:
+        errors.append("{} is only available for {} to {} qubits".format(args.ineq, qubits[0], qubits[-1]))
+
+    if args.rep < 1:
+        errors.append("--rep must be at least 1")
+    if args.shots < 1:
+        errors.append("--shots must be at least 1")
+    if args.thetas < 2:
+        errors.append("--thetas must be at least 2")
+    if args.plot and args.ineq != 'chsh':
+        errors.append("--plot is only available for chsh")
+    if args.archive and args.ineq == 'chsh':
+        errors.append("--archive is not available for chsh")
+    if args.memory and args.ineq == 'chsh':
+        errors.append("--memory is not available for chsh")
+    if args.pack and args.ineq != 'chsh':
+        errors.append("--pack is only available for chsh")
+    if args.interleave and args.ineq == 'chsh':
+        errors.append("--interleave is not available for chsh")
+    if args.interleave and args.parametric:
+        errors.append("--interleave and --parametric cannot be combined")
+    if args.twirl < 0:
+        errors.append("--twirl must not be negative")
+    if args.twirl and args.ineq == 'chsh':
+        errors.append("--twirl is not available for chsh")
+    if args.twirl and (args.mitigate or args.memory or args.interleave):
+        errors.append("--twirl cannot be combined with --mitigate, --memory or --interleave")
+    if args.twirl > args.shots:
+        errors.append("--twirl needs at least one shot per instance")
+    if args.zne and args.ineq == 'chsh':
+        errors.append("--zne is not available for chsh")
+    if args.zne and any(scale < 1 or scale % 2 != 1 for scale in args.zne):
+        errors.append("--zne scale factors must be odd positive integers")
+    if args.zne and len(args.zne) < 2:
+        errors.append("--zne needs at least two scale factors")
+    if args.zne and (args.twirl or args.interleave):
+        errors.append("--zne cannot be combined with --twirl or --interleave")
+
+    return errors
+
+
+def run(args):
+    """
+    :param args: parsed and validated arguments of the run command
+    """
+    if args.ineq == 'chsh':
+        chsh = load_script('chsh')
+        theta_vec, CHSH1, CHSH2 = chsh.run_chsh(device=args.device, number_of_thetas=args.thetas, shots=args.shots,
+                                                 pack=args.pack)
+        print("CHSH1: ", CHSH1)
+        print("CHSH2: ", CHSH2)
+
+        if args.plot:
+            # rendered in the background, waited for only at the very end
+            chsh.plot_chsh(theta_vec, CHSH1, CHSH2, label=args.device, filename=args.plot).result()
+        return
+
+    inequality = load_script('inequality')
+    expectation = inequality.Inequality(ineq=args.ineq, qubit=args.n, device=args.device, rep=args.rep,
+                                        shots=args.shots, mitigate=args.mitigate, archive=args.archive,
+                                        memory=args.memory, state_prep=args.state_prep,
+                                        parametric=args.parametric, budget=args.budget,
+                                        placement=args.placement, interleave=args.interleave, twirl=args.twirl,
+                                        zne=args.zne)
+    print("Inequality value: ", expectation)
+
+
+def plot(args):
+    """
+    :param args: parsed arguments of the plot command
+    """
+    from plotting import render_many
+
+    for path in render_many(args.results, out_dir=args.out_dir, fmt=args.format, processes=args.jobs):
+        print(path)
+
+
+def sweep(args):
+    """
+    :param args: parsed arguments of the sweep command
+    """
+    import sweep as sweeps
+
+    spec = sweeps.SweepSpec.from_file(args.spec)
+    for point in spec.points():
+        if point.ineq not in SUPPORTED or point.qubit not in SUPPORTED[point.ineq] or point.ineq == 'chsh':
+            raise SystemExit("bell sweep: {} with {} qubits is not supported".format(point.ineq, point.qubit))
+
+    sweep_plan = sweeps.plan(spec, load_script('inequality'))
+    print("plan: ", sweep_plan.summary())
+    if args.dry_run:
+        return
+
+    from backend_pool import get_backend
+
+    for point, value in sweeps.run(sweep_plan, get_backend, budget=args.budget, reshape=args.reshape).items():
+        print(point, value)
+
+
+def search(args):
+    """
+    :param args: parsed arguments of the search command
+    """
+    import json
+    import numpy as np
+    import angle_search
+
+    if args.ineq == 'chsh':
+        n, correlators, coeffs, phase = 2, angle_search.CHSH_CORRELATORS, angle_search.CHSH_COEFFS, 0.0
+    else:
+        inequality = load_script('inequality')
+        n = args.n or 3
+        name = args.ineq + str(n)
+        correlators, coeffs = inequality.correlator_dict[name], inequality.coeff_dict[name]
+        phase = np.pi / 2 if args.ineq == 'mermin' else 0.0
+
+    if args.device is not None:
+        from backend_pool import pytket_pool
+
+        noise = angle_search.NoiseSnapshot.from_backend_info(pytket_pool.info(args.device, 'backend_info'), n,
+                                                             coherence=args.coherence)
+    else:
+        e = args.readout_error
+        noise = angle_search.NoiseSnapshot(n, args.depolarizing, args.coherence,
+                                           np.tile([[1 - e, e], [e, 1 - e]], (n, 1, 1)))
+
+    result = angle_search.search(correlators, coeffs, noise, phase, samples=args.samples, rounds=args.rounds,
+                                 seed=args.seed)
+    print("best value: ", result.value, " (", int(result.rate()), "candidates per second )")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result.to_dict(), f, indent=1)
+        print("bases written to: ", args.out)
+
+
+def build_parser():
+    """
+    :return: argument parser of the bell command
+    """
+    parser = argparse.ArgumentParser(prog="bell", description="Experimental tests of Bell-type inequalities")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run an experiment")
+    run_parser.add_argument("ineq", type=str.lower, choices=sorted(SUPPORTED), help="inequality to test")
+    run_parser.add_argument("--n", type=int, default=None, help="number of qubits (default 3, 2 for chsh)")
+    run_parser.add_argument("--device", default=None,
+                            help="backend name, aer_simulator to run locally, or auto for the shortest expected queue "
+                                 "(default ibm_oslo, ibmq_quito for chsh)")
+    run_parser.add_argument("--rep", type=int, default=1, help="mid-circuit repetitions per circuit")
+    run_parser.add_argument("--shots", type=int, default=16384, help="shots per circuit")
+    run_parser.add_argument("--thetas", type=int, default=15, help="number of angles (chsh only)")
+    run_parser.add_argument("--pack", action="store_true",
+                            help="place several settings on disjoint qubit pairs of one circuit (chsh only)")
+    run_parser.add_argument("--mitigate", action="store_true", help="apply readout error mitigation")
+    run_parser.add_argument("--state-prep", choices=["star", "tree", "dynamic"], default="star",
+                            help="GHZ preparation: fan out from qubit 0, a log depth tree on the coupling map, "
+                                 "or constant depth with mid-circuit measurement and feed-forward")
+    run_parser.add_argument("--parametric", action="store_true",
+                            help="compile one circuit with symbolic measurement angles and bind every correlator")
+    run_parser.add_argument("--memory", action="store_true",
+                            help="stream the per-shot memory instead of building counts")
+    run_parser.add_argument("--archive", metavar="DIR", help="store the raw counts in this results archive")
+    run_parser.add_argument("--plot", metavar="FILE", help="save the results and a plot of them (chsh only)")
+    run_parser.add_argument("--interleave", action="store_true",
+                            help="one circuit whose mid-circuit repetitions cycle through all correlators")
+    run_parser.add_argument("--twirl", type=int, default=0, metavar="N",
+                            help="run every correlator as N instances with random readout flips, undone in the analysis")
+    run_parser.add_argument("--zne", type=int, nargs="+", default=None, metavar="SCALE",
+                            help="fold the compiled circuits by these odd noise scale factors, e.g. 1 3 5, "
+                                 "and extrapolate to zero noise")
+    run_parser.add_argument("--placement", choices=["noise"], default=None,
+                            help="place the circuits on the qubits with the lowest calibrated errors")
+    run_parser.add_argument("--budget", type=float, default=None, metavar="SECONDS",
+                            help="reject the run if its estimated QPU time is higher")
+    run_parser.add_argument("--trace", metavar="FILE", help="write a Chrome trace of the pipeline stages")
+    run_parser.add_argument("--trace-memory", action="store_true", help="also record tracemalloc peaks per stage")
+    run_parser.add_argument("--dry-run", action="store_true", help="validate the spec and exit")
+
+    plot_parser = commands.add_parser("plot", help="render plots from stored result files")
+    plot_parser.add_argument("results", nargs="+", help="json result files")
+    plot_parser.add_argument("--format", default="png", help="image format, e.g. png or svg")
+    plot_parser.add_argument("--out-dir", default=None, help="directory of the images (default: next to the results)")
+    plot_parser.add_argument("--jobs", type=int, default=None, help="number of worker processes")
+
+    sweep_parser = commands.add_parser("sweep", help="run a sweep spec (json or yaml)")
+    sweep_parser.add_argument("spec", help="sweep spec file")
+    sweep_parser.add_argument("--dry-run", action="store_true", help="only print the deduplicated plan")
+    sweep_parser.add_argument("--budget", type=float, default=None, metavar="SECONDS",
+                              help="QPU time per device, checked before submission")
+    sweep_parser.add_argument("--reshape", action="store_true",
+                              help="scale the shots down to fit the budget instead of rejecting the sweep")
+
+    search_parser = commands.add_parser("search", help="search measurement angles under a noise model")
+    search_parser.add_argument("ineq", type=str.lower, choices=sorted(SUPPORTED), help="inequality to optimise")
+    search_parser.add_argument("--n", type=int, default=None, help="number of qubits (default 3, 2 for chsh)")
+    search_parser.add_argument("--device", default=None, help="take the noise from this device's calibration")
+    search_parser.add_argument("--depolarizing", type=float, default=0.0, help="depolarizing probability of the state")
+    search_parser.add_argument("--coherence", type=float, default=1.0, help="factor on the GHZ coherence")
+    search_parser.add_argument("--readout-error", type=float, default=0.0, help="symmetric readout error per qubit")
+    search_parser.add_argument("--samples", type=int, default=4096, help="candidates per round")
+    search_parser.add_argument("--rounds", type=int, default=40, help="refinement rounds")
+    search_parser.add_argument("--seed", type=int, default=None, help="random seed")
+    search_parser.add_argument("--out", metavar="FILE", help="write the best bases to this json file")
+
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.command == "plot":
+        plot(args)
+        return 0
+    if args.command == "sweep":
+        sweep(args)
+        return 0
+    if args.command == "search":
+        search(args)
+        return 0
+
+    if args.n is None and args.ineq != 'chsh':
+        args.n = 3
+    if args.device is None:
+        args.device = 'ibmq_quito' if args.ineq == 'chsh' else 'ibm_oslo'
+
+    errors = validate(args)
+    if errors:
+        parser.error("; ".join(errors))
+
+    if args.dry_run:
+        print("spec ok: ", vars(args))
+        return 0
+
+    from tracing import tracer
+
+    if args.trace_memory:
+        tracer.trace_memory()
+
+    run(args)
+
+    if args.trace or args.trace_memory:
+        print(tracer.format_summary())
+    if args.trace:
+        tracer.export(args.trace)
+        print("trace written to: ", args.trace)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
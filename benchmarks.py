@@ -0,0 +1,226 @@
+from contextlib import redirect_stdout
+import argparse
+import io
+import json
+import platform
+import sys
+import time
+
+import numpy as np
+
+from tracing import tracer
+
+# Offline benchmarks of the hot paths, on the local simulator.
+#
+# Every benchmark returns a dict of timings in seconds (and throughput
+# figures where they make sense). The stage timings of Inequality() come
+# from the tracing spans it already records. A run is stored as json; given
+# a baseline file, every timing that got slower by more than the threshold
+# is reported as a regression and the command exits with status 1.
+
+DEVICE = "aer_simulator"
+
+INEQUALITIES = [('mermin', n) for n in range(3, 8)] + [('svetlichny', n) for n in range(3, 5)]
+REPS = [1, 2, 4, 8, 16, 32]
+
+# stages of Inequality(), as named by its tracing spans
+STAGES = ['construction', 'compile', 'submit', 'queue', 'execution', 'download', 'analysis']
+
+
+def _quiet(fn, *args, **kwargs):
+    """
+    :return: fn(*args, **kwargs), with the printing of the experiment scripts swallowed
+    """
+    with redirect_stdout(io.StringIO()):
+        return fn(*args, **kwargs)
+
+
+def _stages(fn, *args, **kwargs):
+    """
+    :return: dict of stage -> seconds of one traced call of fn, plus the total wall time
+    """
+    from fragments import fragment_cache
+
+    # cold caches, so construction and compilation are measured every time
+    fragment_cache.clear()
+    tracer.clear()
+
+    start = time.perf_counter()
+    _quiet(fn, *args, **kwargs)
+    timings = {'total': time.perf_counter() - start}
+
+    summary = tracer.summary()
+    for stage in STAGES:
+        if stage in summary:
+            timings[stage] = summary[stage]['total']
+
+    return timings
+
+
+def bench_inequality(inequality, shots, reps=REPS, inequalities=INEQUALITIES):
+    """
+    :param inequality: the experiment module (bell.load_script('inequality'))
+    :return: dict of 'inequality/<name><n>/rep<r>' -> stage timings
+    """
+    results = {}
+    for ineq, n in inequalities:
+        for rep in reps:
+            results["inequality/{}{}/rep{}".format(ineq, n, rep)] = _stages(
+                inequality.Inequality, ineq=ineq, qubit=n, device=DEVICE, rep=rep, shots=shots)
+
+    return results
+
+
+def bench_crosstalk(shots, reps=REPS):
+    """
+    :return: dict of 'crosstalk/mermin3/<single|parallel>/rep<r>' -> timings
+    """
+    import crosstalk
+    from fragments import fragment_cache
+
+    results = {}
+    for parallel in (False, True):
+        for rep in reps:
+            # cold caches, as in the stage benchmarks
+            fragment_cache.clear()
+            start = time.perf_counter()
+            _quiet(crosstalk.Inequality, ineq="mermin", qubit=3, device=DEVICE, rep=rep, shots=shots,
+                   parallel=parallel)
+            results["crosstalk/mermin3/{}/rep{}".format("parallel" if parallel else "single", rep)] = \
+                {'total': time.perf_counter() - start}
+
+    return results
+
+
+def _chsh_counts(n_thetas, shots, rng):
+    """
+    :return: random qiskit style counts, 4 circuits per theta, as compute_chsh_witness takes them
+    """
+    keys = ['00', '01', '10', '11']
+    draws = rng.multinomial(shots, [0.25] * 4, size=4 * n_thetas)
+
+    return [dict(zip(keys, row.tolist())) for row in draws]
+
+
+def bench_chsh(grids=(100, 1000, 10000), shots=8192, seed=0):
+    """
+    :return: dict of 'chsh/witness/<thetas>' -> timings of compute_chsh_witness
+    """
+    from bell import load_script
+
+    chsh = load_script('chsh')
+    rng = np.random.default_rng(seed)
+
+    results = {}
+    for n_thetas in grids:
+        counts = _chsh_counts(n_thetas, shots, rng)
+        start = time.perf_counter()
+        chsh.compute_chsh_witness(counts)
+        elapsed = time.perf_counter() - start
+        results["chsh/witness/{}".format(n_thetas)] = {'total': elapsed, 'thetas_per_second': n_thetas / elapsed}
+
+    return results
+
+
+def bench_throughput(inequality, runs=20, shots=1024, ineq='mermin', n=3, rep=4):
+    """
+    End to end: repeated Inequality() calls with warm caches, as in a long session.
+
+    :return: dict with circuits/s, shots/s and p50/p99 latency of one call
+    """
+    circuits = len(inequality.correlator_dict[ineq + str(n)])
+
+    _quiet(inequality.Inequality, ineq=ineq, qubit=n, device=DEVICE, rep=rep, shots=shots)
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        _quiet(inequality.Inequality, ineq=ineq, qubit=n, device=DEVICE, rep=rep, shots=shots)
+        latencies.append(time.perf_counter() - start)
+
+    total = sum(latencies)
+
+    return {"throughput/{}{}/rep{}".format(ineq, n, rep): {
+        'total': total,
+        'p50': float(np.percentile(latencies, 50)),
+        'p99': float(np.percentile(latencies, 99)),
+        'circuits_per_second': runs * circuits / total,
+        'shots_per_second': runs * circuits * shots * rep / total}}
+
+
+def run(shots=1024, reps=REPS, quick=False):
+    """
+    :param shots: shots per circuit
+    :param reps: mid-circuit repetitions to sweep
+    :param quick: only mermin3 and svetlichny3, rep 1 and 4, small grids
+    :return: dict with the run's metadata and its results
+    """
+    from bell import load_script
+
+    inequality = load_script('inequality')
+    inequalities = [('mermin', 3), ('svetlichny', 3)] if quick else INEQUALITIES
+    reps = [1, 4] if quick else reps
+
+    results = {}
+    results.update(bench_inequality(inequality, shots, reps, inequalities))
+    results.update(bench_crosstalk(shots, reps))
+    results.update(bench_chsh((100, 1000) if quick else (100, 1000, 10000)))
+    results.update(bench_throughput(inequality, runs=5 if quick else 20, shots=shots))
+
+    return {'meta': {'time': time.strftime("%Y-%m-%d %H:%M:%S"), 'python': platform.python_version(),
+                     'machine': platform.machine(), 'device': DEVICE, 'shots': shots, 'quick': quick},
+            'results': results}
+
+
+def compare(current, baseline, threshold=0.2, metrics=('total', 'p50', 'p99') + tuple(STAGES)):
+    """
+    :param current: result of run()
+    :param baseline: an earlier result of run()
+    :param threshold: allowed relative slow down, 0.2 = 20 %
+    :param metrics: timing keys that are compared
+    :return: list of (benchmark, metric, baseline seconds, current seconds, relative change), regressions only
+    """
+    regressions = []
+    for name, timings in current['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+
+        for metric in metrics:
+            if metric in timings and before.get(metric):
+                change = timings[metric] / before[metric] - 1
+                if change > threshold:
+                    regressions.append((name, metric, before[metric], timings[metric], change))
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="benchmarks", description="Offline benchmarks on the local simulator")
+    parser.add_argument("--out", default="benchmarks.json", help="json file to store the results in")
+    parser.add_argument("--baseline", default=None, help="earlier results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative slow down")
+    parser.add_argument("--shots", type=int, default=1024, help="shots per circuit")
+    parser.add_argument("--quick", action="store_true", help="small subset, for a smoke test")
+    args = parser.parse_args(argv)
+
+    current = run(shots=args.shots, quick=args.quick)
+    with open(args.out, "w") as f:
+        json.dump(current, f, indent=1)
+    print("results written to: ", args.out)
+
+    if args.baseline is None:
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    regressions = compare(current, baseline, args.threshold)
+    for name, metric, before, after, change in regressions:
+        print("REGRESSION {} {}: {:.4f}s -> {:.4f}s (+{:.0%})".format(name, metric, before, after, change))
+    print(len(regressions), "regressions above", "{:.0%}".format(args.threshold))
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+from functools import lru_cache
+import itertools
+
+# Generated correlator tables.
+#
+# The Svetlichny polynomial on n qubits is
+#
+#     S_n = sum over settings of nu_t * A_1 A_2 ... A_n,   nu_t = (-1)^(t(t-1)/2)
+#
+# where every party measures its unprimed or its primed setting and t counts
+# the primed ones. With x/y (unprimed/primed) on the first n-1 qubits and c/d
+# on the last one, the GHZ+ state reaches the quantum maximum 2^(n-1)*sqrt(2)
+# in magnitude; for n = 3 this is exactly the hand written s3 table.
+#
+# The Mermin polynomial on the iGHZ state keeps the x/y strings with an odd
+# number k of y's, with sign (-1)^((k-1)/2); for n = 3..7 these are the hand
+# written m3..m7 tables.
+
+
+def default_bases(n):
+    """
+    :param n: number of qubits
+    :return: tuple of (unprimed, primed) basis symbols per qubit
+    """
+    return (('x', 'y'),) * (n - 1) + (('c', 'd'),)
+
+
+@lru_cache(maxsize=None)
+def svetlichny_correlators(n, bases=None):
+    """
+    :param n: number of qubits
+    :param bases: tuple of (unprimed, primed) basis symbols per qubit, default_bases(n) if None
+    :return: correlators, coeffs: tuples of basis strings and their signs, 2^n of each
+    """
+    if bases is None:
+        bases = default_bases(n)
+    if len(bases) != n:
+        raise ValueError("{} basis pairs given for {} qubits".format(len(bases), n))
+
+    correlators, coeffs = [], []
+    for primed in itertools.product((0, 1), repeat=n):
+        t = sum(primed)
+        correlators.append("".join(pair[p] for pair, p in zip(bases, primed)))
+        coeffs.append(-1 if (t * (t - 1) // 2) % 2 else 1)
+
+    return tuple(correlators), tuple(coeffs)
+
+
+@lru_cache(maxsize=None)
+def mermin_correlators(n):
+    """
+    :param n: number of qubits
+    :return: correlators, coeffs: tuples of basis strings and their signs, 2^(n-1) of each
+    """
+    correlators, coeffs = [], []
+    for string in itertools.product('xy', repeat=n):
+        k = string.count('y')
+        if k % 2:
+            correlators.append("".join(string))
+            coeffs.append(-1 if (k // 2) % 2 else 1)
+
+    return tuple(correlators), tuple(coeffs)
+
+
+_GENERATORS = {'svetlichny': svetlichny_correlators, 'mermin': mermin_correlators}
+
+
+class GeneratedTable(dict):
+    """
+    Hand written tables, keyed like 'svetlichny3', that fall back to the
+    generator for any other 'svetlichnyN' or 'merminN'.
+    """
+
+    def __init__(self, tables, part):
+        """
+        :param tables: dict of hand written entries
+        :param part: 0 for the correlator table, 1 for the coefficient table
+        """
+        super().__init__(tables)
+        self.part = part
+
+    def __missing__(self, key):
+        for name, generate in _GENERATORS.items():
+            if key.startswith(name) and key[len(name):].isdigit():
+                return list(generate(int(key[len(name):]))[self.part])
+
+        raise KeyError(key)
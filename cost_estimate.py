@@ -0,0 +1,205 @@
+from pytket import OpType
+import itertools
+import math
+
+# QPU time of a batch, estimated before it is submitted.
+#
+# Every compiled circuit is scheduled as soon as possible: a command starts
+# when all of its qubits and bits are free and takes the device's length for
+# that gate on those qubits (rz is virtual, barriers only synchronise). A
+# shot costs the circuit duration plus the repetition delay between shots,
+# so a batch costs sum(shots * (duration + rep_delay)). pytket submits the
+# circuits of equal shot count together, max_experiments per job, which
+# gives the job count.
+
+# rough lengths in seconds of an IBM Falcon device, used when the device reports none
+DEFAULT_LENGTHS = {'rz': 0.0, 'sx': 35.5e-9, 'x': 35.5e-9, 'id': 35.5e-9, 'cx': 400e-9, 'ecr': 500e-9,
+                   'measure': 5e-6, 'reset': 5e-6, 'barrier': 0.0}
+DEFAULT_REP_DELAY = 250e-6
+
+# classical latency of a conditional gate, waiting for the measurement it depends on
+DEFAULT_FEED_FORWARD = 1e-6
+
+
+class BudgetExceeded(ValueError):
+    pass
+
+
+class GateTimings:
+    """
+    Gate, measurement and reset lengths of a device, and its job limits.
+    """
+
+    def __init__(self, lengths=None, defaults=DEFAULT_LENGTHS, rep_delay=DEFAULT_REP_DELAY,
+                 max_experiments=300, max_shots=100000, feed_forward=DEFAULT_FEED_FORWARD):
+        """
+        :param lengths: dict of (gate name, physical qubits tuple) -> seconds
+        :param defaults: dict of gate name -> seconds, for gates missing from lengths
+        :param rep_delay: seconds between two shots
+        :param max_experiments: circuits per job
+        :param max_shots: shots per circuit and job
+        :param feed_forward: extra seconds of a classically conditioned gate
+        """
+        self.lengths = lengths or {}
+        self.defaults = defaults
+        self.rep_delay = rep_delay
+        self.max_experiments = max_experiments
+        self.max_shots = max_shots
+        self.feed_forward = feed_forward
+
+    @classmethod
+    def from_qiskit(cls, properties, configuration):
+        """
+        :param properties: qiskit BackendProperties (backend.properties()), or None on simulators
+        :param configuration: qiskit BackendConfiguration (backend.configuration())
+        :return: GateTimings with the device's calibrated lengths and limits
+        """
+        lengths = {}
+        if properties is not None:
+            for gate in properties.gates:
+                for param in gate.parameters:
+                    if param.name == 'gate_length':
+                        # reported in ns
+                        lengths[(gate.gate, tuple(gate.qubits))] = param.value * 1e-9
+            for q in range(len(properties.qubits)):
+                try:
+                    lengths[('measure', (q,))] = properties.readout_length(q)
+                except Exception:
+                    pass
+
+        return cls(lengths,
+                   rep_delay=getattr(configuration, 'default_rep_delay', None) or DEFAULT_REP_DELAY,
+                   max_experiments=getattr(configuration, 'max_experiments', None) or 300,
+                   max_shots=getattr(configuration, 'max_shots', None) or 100000)
+
+    def duration(self, name, qubits):
+        """
+        :param name: qiskit gate name, e.g. cx
+        :param qubits: tuple of physical qubit indices
+        :return: seconds
+        """
+        if (name, qubits) in self.lengths:
+            return self.lengths[(name, qubits)]
+        if name == 'reset' and ('measure', qubits) in self.lengths:
+            return self.lengths[('measure', qubits)]
+
+        return self.defaults.get(name, self.defaults['cx'] if len(qubits) > 1 else self.defaults['sx'])
+
+
+def device_timings(device):
+    """
+    :param device: device name
+    :return: GateTimings of the device, from the pooled (ttl cached) qiskit properties and configuration
+    """
+    from backend_pool import qiskit_pool
+
+    return GateTimings.from_qiskit(qiskit_pool.info(device, 'properties'), qiskit_pool.info(device, 'configuration'))
+
+
+def circuit_duration(circuit, timings):
+    """
+    :param circuit: compiled pytket circuit, on physical qubits
+    :param timings: GateTimings
+    :return: seconds of one shot, without the repetition delay
+    """
+    free = {}
+
+    for cmd in circuit.get_commands():
+        units = cmd.args
+        start = max((free.get(u, 0.0) for u in units), default=0.0)
+
+        op = cmd.op
+        extra = 0.0
+        if op.type == OpType.Conditional:
+            op = op.op
+            extra = timings.feed_forward
+
+        if op.type == OpType.Barrier:
+            length = 0.0
+        else:
+            qubits = tuple(q.index[0] for q in cmd.qubits)
+            length = timings.duration(op.type.name.lower(), qubits) + extra
+
+        for u in units:
+            free[u] = start + length
+
+    return max(free.values(), default=0.0)
+
+
+class CostEstimate:
+
+    def __init__(self, durations, shots, timings):
+        """
+        :param durations: seconds per shot of every circuit
+        :param shots: shots of every circuit
+        :param timings: GateTimings used
+        """
+        self.durations = durations
+        self.shots = shots
+        self.timings = timings
+
+    def circuit_seconds(self):
+        """
+        :return: QPU seconds of every circuit, repetition delays included
+        """
+        return [s * (d + self.timings.rep_delay) for d, s in zip(self.durations, self.shots)]
+
+    def total(self):
+        return sum(self.circuit_seconds())
+
+    def jobs(self):
+        """
+        :return: number of jobs, circuits of equal shot count are submitted together
+        """
+        executions = [min(s, self.timings.max_shots) for s in self.shots
+                      for _ in range(math.ceil(s / self.timings.max_shots))]
+
+        return sum(math.ceil(len(list(group)) / self.timings.max_experiments)
+                   for _, group in itertools.groupby(sorted(executions)))
+
+    def summary(self):
+        """
+        :return: dict with the circuit count, total shots, longest circuit, total seconds and job count
+        """
+        return {'circuits': len(self.shots), 'shots': sum(self.shots),
+                'longest_circuit': max(self.durations, default=0.0), 'seconds': self.total(), 'jobs': self.jobs()}
+
+
+def estimate(circuits, shots, timings):
+    """
+    :param circuits: compiled pytket circuits
+    :param shots: shots per circuit, an int or a list with one entry per circuit
+    :param timings: GateTimings
+    :return: CostEstimate
+    """
+    if isinstance(shots, int):
+        shots = [shots] * len(circuits)
+
+    return CostEstimate([circuit_duration(c, timings) for c in circuits], list(shots), timings)
+
+
+def enforce(cost, seconds=None, jobs=None, reshape=False):
+    """
+    :param cost: CostEstimate
+    :param seconds: QPU time budget, unlimited if None
+    :param jobs: job budget, unlimited if None
+    :param reshape: scale the shots down to fit the time budget instead of rejecting
+    :return: shots per circuit, the original ones if within budget
+    """
+    shots = cost.shots
+
+    if seconds is not None and cost.total() > seconds:
+        if not reshape:
+            raise BudgetExceeded("estimated {:.1f} s of QPU time, budget {:.1f} s".format(cost.total(), seconds))
+
+        # keep the ratios between circuits, e.g. of a mid-circuit sweep's per-circuit shot counts
+        scale = seconds / cost.total()
+        shots = [max(1, int(s * scale)) for s in shots]
+        cost = CostEstimate(cost.durations, shots, cost.timings)
+        if cost.total() > seconds:
+            raise BudgetExceeded("even one shot per circuit takes {:.1f} s, budget {:.1f} s".format(cost.total(), seconds))
+
+    if jobs is not None and cost.jobs() > jobs:
+        raise BudgetExceeded("{} jobs needed, budget {}".format(cost.jobs(), jobs))
+
+    return shots
@@ -1,13 +1,19 @@
 from qiskit import QuantumCircuit
-from pytket.extensions.qiskit import IBMQBackend
+from backend_pool import get_backend
 from pytket import Circuit
 from pytket.extensions.qiskit import qiskit_to_tk, tk_to_qiskit
-from pytket.utils import expectation_from_counts
+from packed_counts import PackedCounts
+from fragments import fragment_cache
 from pytket import OpType
-import collections
 import time
 
-def mermin3(parallel):
+# this script's circuits, kept apart from what the other scripts cache under the same keys
+fragments = fragment_cache.scoped("crosstalk")
+
+# inequalities whose state preparation takes a parallel argument (two GHZ copies)
+PARALLEL = {'mermin3'}
+
+def mermin3(parallel=False):
     """
     :return: qc, GHZ state circuit with 3 qubits, phase of i
     """
@@ -129,10 +135,148 @@ def svet4():
 
     return qc
 
-def Inequality(ineq, qubit, device, rep, shots, parallel):
+def measurements(string, parallel):
+    """
+    :param string: Sequence of bases for measurements (e.g. XXY, YXYY, XXYYX)
+    :param parallel: measure both GHZ copies in the same bases
+    :return: qc: quantum circuit to project measurements into Y or X bases
+    """
+    if (parallel):
+        string=string+string
+
+    qc = Circuit(len(string),len(string))
+
+    for i in range (0,len(string)):
+
+        # x measurement basis
+        if string[i] == "x":
+            qc.H(i)
+
+        # z measurement basis, no rotation (an idle copy when multiplexing)
+        elif string[i] == "z":
+            pass
+
+        # y measurement basis
+        elif string[i] == "y":
+            qc.Sdg(i)
+            qc.H(i)
+
+        # c=y-x/sqrt(2)
+        elif string[i] == "c":
+            qc.Tdg(i)
+            qc.Sdg(i)
+            qc.H(i)
+
+        # equivalent of c'= -(X+Y)/sqrt(2)
+        elif string[i] == "d":
+            qc.T(i)
+            qc.S(i)
+            qc.H(i)
+
+        else:
+            print("ERROR! unrecognized symbol: ",string[i])
+            exit(1)
+
+    # barrier used to isolate sections which Pytket can optimize
+    qc.add_barrier(range(0,len(string)))
+
+    return qc
+
+def correlator_circuit(ineq, prepare, string, rep, parallel):
+    """
+    :param ineq: inequality and number of qubits, e.g. mermin3
+    :param prepare: state preparation function, e.g. mermin3
+    :param string: Sequence of bases for measurements (e.g. XXY, YXYY, XXYYX)
+    :param rep: number of midcircuit measurements
+    :param parallel: two GHZ copies side by side
+    :return: d: circuit measuring qubit h of repetition r into bit h+(r*qubit*p)
+    """
+    qubit=len(string)
+    p=1
+    if(parallel):
+        p=2
+
+    if(parallel):
+        c = fragments.get(('state', ineq, p), lambda: qiskit_to_tk(prepare(parallel)))
+    else:
+        c = fragments.get(('state', ineq, p), lambda: qiskit_to_tk(prepare()))
+    c.append(fragments.get(('basis', string, p), lambda: measurements(string, parallel)))
+
+    return _repeat(c, qubit*p, rep)
+
+def multiplexed_circuit(ineq, prepare, strings, rep):
+    """
+    :param ineq: inequality and number of qubits, e.g. mermin3
+    :param prepare: state preparation function with a parallel argument, e.g. mermin3
+    :param strings: one basis string per GHZ copy, copy k is measured in strings[k]; None for an idle copy,
+                    read out in the z basis and ignored
+    :param rep: number of midcircuit measurements
+    :return: d: circuit measuring qubit h of copy k in repetition r into bit h+(k*qubit)+(r*qubit*p)
+    """
+    qubit=len(next(s for s in strings if s is not None))
+    p=len(strings)
+    layer = "".join("z"*qubit if s is None else s for s in strings)
+
+    c = fragments.get(('state', ineq, p), lambda: qiskit_to_tk(prepare(True)))
+    c.append(fragments.get(('basis', layer, 1), lambda: measurements(layer, False)))
+
+    return _repeat(c, qubit*p, rep)
+
+def _repeat(c, width, rep):
+    """
+    :param c: state preparation and measurement layer on width qubits
+    :return: d: c repeated rep times, qubit h of repetition r measured into bit h+(r*width), with resets in between
+    """
+    d = Circuit(0,rep*width)
+
+    for r in range(0,rep):
+        d.append(c)
+
+        # need to specify which measurements go where!
+        for h in range(0,width):
+            d.Measure(h,h+(r*width))
+
+        if (r<rep-1):
+            d.add_barrier(range(0, width))
+            for z in range(0,width):
+                d.add_gate(OpType.Reset, [z])
+
+    return d
+
+def assignments(correlators, copies, rotations=1):
+    """
+    Packs the correlators onto parallel copies, copies at a time, so one pass
+    takes ceil(len(correlators) / copies) circuits. The last circuit is filled
+    up with idle copies (None), not with repeated correlators. Every further
+    pass shifts the assignment within each circuit by one more copy, so with
+    rotations=copies every correlator is measured on every copy exactly once
+    and a bias of one copy averages out; the shots are then split over the
+    passes (see _multiplexed), not multiplied by them.
+
+    :param correlators: basis strings of the inequality
+    :param copies: GHZ copies per circuit
+    :param rotations: passes over the correlators, each with the assignment shifted by one more copy
+    :return: list of circuits, each a list of one basis string (or None) per copy
+    """
+    groups = [[correlators[g*copies + k] if g*copies + k < len(correlators) else None for k in range(copies)]
+              for g in range(-(-len(correlators) // copies))]
+
+    circuits = []
+    for r in range(rotations):
+        for i, group in enumerate(groups):
+            shift = (i + r) % copies
+            circuits.append(group[shift:] + group[:shift])
+
+    return circuits
+
+def Inequality(ineq, qubit, device, rep, shots, parallel, multiplex=False, rotations=1):
     """
     Add documentation here
-    :return: expectation: experimental bell-type inequality value
+    :param parallel: two GHZ copies side by side, only mermin3 prepares them
+    :param multiplex: measure different correlators on the parallel copies (needs parallel), see assignments
+    :param rotations: passes over the correlators in multiplex mode, sharing the shots, see assignments
+    :return: expectation: experimental bell-type inequality value, one per copy; in multiplex mode
+             the copies share one value, returned as (expectation, None)
     """
 
     ineq=ineq.lower() + str(qubit)
@@ -140,7 +284,9 @@ def Inequality(ineq, qubit, device, rep, shots, parallel):
     function_dict = {'mermin3': mermin3, 'mermin4': mermin4, 'mermin5': mermin5, 'mermin6': mermin6, 'mermin7': mermin7,
                      'svetlichny3': svet3, 'svetlichny4': svet4}
 
-    state=qiskit_to_tk( function_dict[ineq](parallel) ).copy()
+    # fail before any circuit is built, not in prepare(True) halfway through
+    if (parallel or multiplex) and ineq not in PARALLEL:
+        raise ValueError("parallel copies are only prepared for {}, not {}".format(", ".join(sorted(PARALLEL)), ineq))
 
     # Mermin measurements for iGHZ state.
     m3=["xxy", "xyx", "yxx", "yyy"]
@@ -234,49 +380,6 @@ def Inequality(ineq, qubit, device, rep, shots, parallel):
                      'svetlichny3': coeff_s3, 'svetlichny4': coeff_s4}
 
 
-    def measurements(string, parallel):
-        """
-        :param string: Sequence of bases for measurements (e.g. XXY, YXYY, XXYYX)
-        :return: qc: quantum circuit to project measurements into Y or X bases
-        """
-        if (parallel):
-            string=string+string
-            print("parallel string: ", string)
-
-        qc = Circuit(len(string),len(string))
-
-        for i in range (0,len(string)):
-
-            # x measurement basis
-            if string[i] == "x":
-                qc.H(i)
-
-            # y measurement basis
-            elif string[i] == "y":
-                qc.Sdg(i)
-                qc.H(i)
-
-            # c=y-x/sqrt(2)
-            elif string[i] == "c":
-                qc.Tdg(i)
-                qc.Sdg(i)
-                qc.H(i)
-
-            # equivalent of c'= -(X+Y)/sqrt(2)
-            elif string[i] == "d":
-                qc.T(i)
-                qc.S(i)
-                qc.H(i)
-
-            else:
-                print("ERROR! unrecognized symbol: ",string[i])
-                exit(1)
-
-        # barrier used to isolate sections which Pytket can optimize
-        qc.add_barrier(range(0,len(string)))
-
-        return qc
-
     # list of circuits to be compiled and run
     circ_list=[]
 
@@ -284,31 +387,22 @@ def Inequality(ineq, qubit, device, rep, shots, parallel):
     if(parallel):
         p=2
 
+    if multiplex:
+        return _multiplexed(ineq, qubit, device, rep, shots, function_dict[ineq], correlator_dict[ineq],
+                            coeff_dict[ineq], p, rotations)
+
     # append measurements in x/y bases
     # also do repetitions based on number of midcicuit measurements requested
     for m in correlator_dict[ineq]:
 
-        c = state.copy()
-        c.append(measurements(m, parallel))
-        d = Circuit(0,rep*qubit*p)
-
-        for r in range(0,rep):
-            d.append(c)
-
-            # need to specify which measurements go where!
-            for h in range(0,qubit*p):
-                d.Measure(h,h+(r*qubit*p))
-
-            if (r<rep-1):
-                d.add_barrier(range(0, qubit*p))
-                for z in range(0,qubit*p):
-                    d.add_gate(OpType.Reset, [z])
-
+        # fragments (converted state, measurement layer, assembled circuit) are built once per process
+        d = fragments.get(('circuit', ineq, m, rep, p),
+                          lambda: correlator_circuit(ineq, function_dict[ineq], m, rep, parallel))
         circ_list.append(d)
         print(tk_to_qiskit(d))
 
     # does this work for simulators as well? Could be useful to check optimal results.
-    backend = IBMQBackend(device)
+    backend = get_backend(device)
 
     start = time.time()
     print("compiling circuits...")
@@ -325,49 +419,72 @@ def Inequality(ineq, qubit, device, rep, shots, parallel):
 
     for coeff, result, corr in zip(coeff_dict[ineq], result_list, correlator_dict[ineq]):
 
-        counts = result.get_counts()
+        counts = PackedCounts.from_counts(result.get_counts())
 
-        # need separate counters I guess when parallelized?
-        d1 = collections.Counter()
-        d2 = collections.Counter()
+        # each repetition holds p qubit sized blocks, one per copy:
+        # [rep 0 copy 0, rep 0 copy 1, rep 1 copy 0, ...]
+        blocks = counts.block_expectations(qubit).reshape(rep, p)
+        copies = blocks.mean(axis=0)
 
-        for i in counts:
-            val = i
-            count = counts[i]
-            #print(count)
-            # split the tuple into qubit pieces
-            val = tuple(val[x:x + qubit]
-                        for x in range(0, len(val), qubit))
+        expectation1 += coeff * copies[0]
+        # also print out the correlator string here for clarity
+        print("ineq 1: ", copies[0], coeff, corr)
 
-            # I think this is the critical area
-            # this assumes parallelization. will need to fix for all general cases without it!
+        if parallel:
+            expectation2 += coeff * copies[1]
+            print("ineq 2: ", copies[1], coeff, corr)
 
-            # for the 6 qubits, first 3 go to d1, second 3 go to d2.
+    return expectation1, expectation2
 
+def _multiplexed(ineq, qubit, device, rep, shots, prepare, correlators, coeffs, p, rotations):
+    """
+    :return: expectation, None: bell-type inequality value from correlators packed p per circuit,
+             shots split over the rotations
+    """
+    if p < 2:
+        print("ERROR! multiplexing needs parallel copies")
+        exit(1)
 
-            # we're only doing 3 qubit pairs so it doesn't need ot be complicated.
-            # i think the above code will work fine. let's see:
-            # len(val) will just = 2
+    packing = assignments(correlators, p, rotations)
 
-            #print(val)
-            #print(val[0], val[1])
-            d1[val[0]] = d1[val[0]] + count
-            d2[val[1]] = d2[val[1]] + count
-            #for k in range(0, len(val)/2): #len(val)):
-            #    d1[val[k]] = d1[val[k]] + count
+    # the passes share the shots, so rotating the copies costs circuits but no extra shots
+    shots = max(1, shots // rotations)
 
-            #for k in range(0, len(val)/2): #len(val)):
-            #    d2[val[k]] = d2[val[k]] + count          # but what should count be then?
+    circ_list=[]
+    for strings in packing:
+        d = fragments.get(('circuit', ineq, tuple(strings), rep, p),
+                          lambda: multiplexed_circuit(ineq, prepare, strings, rep))
+        circ_list.append(d)
+        print(tk_to_qiskit(d))
 
+    backend = get_backend(device)
 
+    start = time.time()
+    print("compiling", len(circ_list), "circuits for", len(correlators), "correlators...")
+    circ_list = backend.get_compiled_circuits(circ_list, optimisation_level=2)
+    end = time.time()
+    print("compilation finished in : ", end - start, " seconds")
 
-        expectation1 += coeff * expectation_from_counts(d1)
-        expectation2 += coeff * expectation_from_counts(d2)
-        # also print out the correlator string here for clarity
-        print("ineq 1: ", expectation_from_counts(d1), coeff, corr)
-        print("ineq 2: ", expectation_from_counts(d2), coeff, corr)
+    handle_list = backend.process_circuits(circ_list, n_shots=shots)
+    result_list = backend.get_results(handle_list)
 
-    return expectation1, expectation2
+    # every (circuit, copy) is one sample of its correlator, averaged over the repetitions
+    samples = {m: [] for m in correlators}
+    for strings, result in zip(packing, result_list):
+        counts = PackedCounts.from_counts(result.get_counts())
+        copies = counts.block_expectations(qubit).reshape(rep, p).mean(axis=0)
+
+        for m, value in zip(strings, copies):
+            if m is not None:
+                samples[m].append(value)
+
+    expectation = 0
+    for m, coeff in zip(correlators, coeffs):
+        value = sum(samples[m]) / len(samples[m])
+        expectation += coeff * value
+        print(value, coeff, m, "copies:", len(samples[m]))
+
+    return expectation, None
 
 if __name__ == "__main__":
 
@@ -0,0 +1,155 @@
+from cost_estimate import GateTimings
+
+# Queue aware choice of device.
+#
+# Every candidate backend of the provider that is operational, large enough
+# and (if asked for) supports mid-circuit measurement and feed-forward gets
+# an expected time to result: its pending jobs times an average job length,
+# plus the QPU time of this experiment from its repetition delay and readout
+# length. The device with the lowest expected time wins. The provider only
+# needs backends(), and every backend name(), status() and configuration()
+# (properties() optional), so FakeProvider below can stand in for IBMQ with
+# scripted queue states.
+
+# average seconds a job ahead of us in the queue occupies the device
+DEFAULT_JOB_SECONDS = 60.0
+
+
+class Candidate:
+
+    def __init__(self, name, pending_jobs, queue_seconds, run_seconds):
+        self.name = name
+        self.pending_jobs = pending_jobs
+        self.queue_seconds = queue_seconds
+        self.run_seconds = run_seconds
+
+    @property
+    def seconds(self):
+        return self.queue_seconds + self.run_seconds
+
+    def __repr__(self):
+        return "Candidate({}, pending_jobs={}, expected {:.0f} s)".format(self.name, self.pending_jobs, self.seconds)
+
+
+def supports(configuration, qubits, mid_circuit=False, dynamic=False):
+    """
+    :param configuration: qiskit BackendConfiguration
+    :param qubits: number of qubits needed
+    :param mid_circuit: mid-circuit measurements and resets are needed (rep > 1)
+    :param dynamic: classically conditioned gates are needed
+    :return: True if the device can run the experiment
+    """
+    if getattr(configuration, 'simulator', False) or configuration.n_qubits < qubits:
+        return False
+
+    instructions = getattr(configuration, 'supported_instructions', None) or []
+    if mid_circuit and not (getattr(configuration, 'multi_meas_enabled', False) or 'reset' in instructions):
+        return False
+    if dynamic and not (getattr(configuration, 'conditional', False) or 'if_else' in instructions):
+        return False
+
+    return True
+
+
+def candidates(provider, qubits, circuits, shots, rep=1, mid_circuit=False, dynamic=False,
+               job_seconds=DEFAULT_JOB_SECONDS):
+    """
+    :param provider: object with backends(), e.g. IBMQ.get_provider('ibm-q') or FakeProvider
+    :param qubits: qubits per circuit
+    :param circuits: number of circuits of the experiment
+    :param shots: shots per circuit
+    :param rep: mid-circuit repetitions per circuit
+    :param mid_circuit: mid-circuit measurements and resets are needed
+    :param dynamic: classically conditioned gates are needed
+    :param job_seconds: seconds per queued job, or a dict of device name -> seconds
+    :return: list of Candidate, the fastest first
+    """
+    found = []
+    for backend in provider.backends():
+        configuration = backend.configuration()
+        if not supports(configuration, qubits, mid_circuit, dynamic):
+            continue
+
+        status = backend.status()
+        if not status.operational:
+            continue
+
+        properties = backend.properties() if hasattr(backend, 'properties') else None
+        timings = GateTimings.from_qiskit(properties, configuration)
+
+        # every shot reads and (but for the last repetition) resets all qubits rep times
+        per_shot = timings.rep_delay + rep * timings.duration('measure', ()) + (rep - 1) * timings.duration('reset', ())
+        per_job = job_seconds.get(backend.name(), DEFAULT_JOB_SECONDS) if isinstance(job_seconds, dict) else job_seconds
+
+        found.append(Candidate(backend.name(), status.pending_jobs, status.pending_jobs * per_job,
+                               circuits * shots * per_shot))
+
+    return sorted(found, key=lambda c: (c.seconds, c.name))
+
+
+def select_device(provider, qubits, circuits, shots, rep=1, dynamic=False, job_seconds=DEFAULT_JOB_SECONDS):
+    """
+    :return: name of the device with the lowest expected time to result, see candidates
+    """
+    ranked = candidates(provider, qubits, circuits, shots, rep, mid_circuit=rep > 1, dynamic=dynamic,
+                        job_seconds=job_seconds)
+    if not ranked:
+        raise ValueError("no operational device with {} qubits{}".format(qubits, " and dynamic circuits" if dynamic else ""))
+
+    for candidate in ranked:
+        print(candidate)
+
+    return ranked[0].name
+
+
+class FakeStatus:
+
+    def __init__(self, operational, pending_jobs):
+        self.operational = operational
+        self.pending_jobs = pending_jobs
+
+
+class FakeConfiguration:
+
+    def __init__(self, n_qubits, conditional=False, multi_meas_enabled=True, default_rep_delay=250e-6):
+        self.n_qubits = n_qubits
+        self.conditional = conditional
+        self.multi_meas_enabled = multi_meas_enabled
+        self.default_rep_delay = default_rep_delay
+        self.simulator = False
+        self.max_experiments = 300
+        self.max_shots = 100000
+
+
+class FakeBackend:
+    """
+    Backend with a scripted queue: every status() call returns the next
+    (operational, pending_jobs) pair, the last one repeats.
+    """
+
+    def __init__(self, name, configuration, queue):
+        self._name = name
+        self._configuration = configuration
+        self._queue = list(queue)
+
+    def name(self):
+        return self._name
+
+    def configuration(self):
+        return self._configuration
+
+    def properties(self):
+        return None
+
+    def status(self):
+        operational, pending_jobs = self._queue[0] if len(self._queue) == 1 else self._queue.pop(0)
+        return FakeStatus(operational, pending_jobs)
+
+
+class FakeProvider:
+
+    def __init__(self, backends):
+        self._backends = list(backends)
+
+    def backends(self):
+        return list(self._backends)
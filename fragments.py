@@ -0,0 +1,70 @@
+# Memoized circuit fragments.
+#
+# Building a correlator circuit means converting the qiskit state preparation
+# with qiskit_to_tk, building the measurement layer of its basis string and
+# stitching rep copies together. All three only depend on (inequality, n,
+# basis string, rep, parallel copies), so they are built once per process
+# and every later request is a copy of the cached fragment. The scripts
+# build different circuits for the same (inequality, basis, ...) keys, so
+# each one reads the shared cache through its own scope, which prefixes
+# every key with the script's name.
+
+
+class FragmentCache:
+    """
+    Fragments (pytket circuits) keyed by a tuple, built on first request.
+    """
+
+    def __init__(self):
+        self._fragments = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, build):
+        """
+        :param key: hashable key, e.g. ('state', 'mermin3', 1) or ('basis', 'xxy', 1)
+        :param build: callable returning the fragment, called only on a miss
+        :return: a copy of the cached fragment, safe to modify
+        """
+        if key in self._fragments:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self._fragments[key] = build()
+
+        return self._fragments[key].copy()
+
+    def scoped(self, scope):
+        """
+        :param scope: name of the script using the cache, e.g. 'crosstalk'
+        :return: FragmentScope with every key prefixed by scope
+        """
+        return FragmentScope(self, scope)
+
+    def clear(self):
+        self._fragments.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._fragments)
+
+
+class FragmentScope:
+    """
+    View of a FragmentCache whose keys are prefixed with a scope name.
+    """
+
+    def __init__(self, cache, scope):
+        self.cache = cache
+        self.scope = scope
+
+    def get(self, key, build):
+        """
+        :return: see FragmentCache.get, for the key (scope,) + key
+        """
+        return self.cache.get((self.scope,) + key, build)
+
+
+# shared by every script in the process
+fragment_cache = FragmentCache()
@@ -0,0 +1,175 @@
+from qiskit import QuantumCircuit
+from pytket import Circuit, OpType
+from pytket.circuit import Bit, Qubit
+from collections import deque
+
+# Topology aware GHZ preparation.
+#
+# mermin3()..mermin7() fan CNOTs out of qubit 0 and svet3()/svet4() use a
+# chain, both linear in depth, and the star needs SWAPs on heavy-hex devices.
+# Here the GHZ state grows as a breadth first tree on physical neighbours:
+# in every layer each qubit that is already entangled passes the state on to
+# at most one new neighbour, so the number of entangled qubits can double per
+# layer (log2(n) layers with all-to-all coupling) and every CNOT acts on a
+# coupled pair.
+
+
+def _neighbours(coupling_map):
+    """
+    :param coupling_map: list of (a, b) physical qubit pairs, direction is ignored
+    :return: dict of qubit -> sorted list of coupled qubits
+    """
+    graph = {}
+    for a, b in coupling_map:
+        graph.setdefault(a, set()).add(b)
+        graph.setdefault(b, set()).add(a)
+
+    return {q: sorted(nbrs) for q, nbrs in graph.items()}
+
+
+def _reach(graph, root, n):
+    """
+    :return: the (up to) n qubits closest to root in breadth first order, and the distance of the last one
+    """
+    qubits = [root]
+    distance = {root: 0}
+    queue = deque([root])
+    while queue and len(qubits) < n:
+        q = queue.popleft()
+        for r in graph.get(q, []):
+            if r not in distance and len(qubits) < n:
+                distance[r] = distance[q] + 1
+                qubits.append(r)
+                queue.append(r)
+
+    return qubits, distance[qubits[-1]]
+
+
+def ghz_schedule(n, coupling_map=None, root=None):
+    """
+    :param n: number of qubits in the GHZ state
+    :param coupling_map: list of (a, b) physical qubit pairs, all-to-all on range(n) if None
+    :param root: physical qubit holding the initial hadamard, if None the qubit that reaches n qubits in the fewest hops
+    :return: qubits, layers: the n physical qubits used (qubits[0] is the root), and a list of
+             layers, each a list of (control, target) physical pairs acting on disjoint qubits
+    """
+    if coupling_map is None:
+        coupling_map = [(a, b) for a in range(n) for b in range(a + 1, n)]
+    graph = _neighbours(coupling_map)
+
+    if root is None:
+        reachable = [q for q in sorted(graph) if len(_reach(graph, q, n)[0]) == n] or [min(graph, default=0)]
+        root = min(reachable, key=lambda q: _reach(graph, q, n)[1])
+
+    # the n qubits closest to the root keep the tree shallow
+    qubits = _reach(graph, root, n)[0]
+
+    if len(qubits) < n:
+        raise ValueError("only {} connected qubits reachable from qubit {}, {} needed".format(len(qubits), root, n))
+
+    chosen = set(qubits)
+    entangled = [root]
+    layers = []
+
+    while len(entangled) < n:
+        layer = []
+        targeted = set()
+        done = set(entangled)
+
+        for control in list(entangled):
+            candidates = [q for q in graph[control] if q in chosen and q not in done and q not in targeted]
+            if not candidates:
+                continue
+
+            # prefer targets that can keep spreading the state in the next layer
+            target = max(candidates, key=lambda q: (sum(1 for r in graph[q] if r in chosen and r not in done), -q))
+            layer.append((control, target))
+            targeted.add(target)
+
+        entangled.extend(target for _, target in layer)
+        layers.append(layer)
+
+    return qubits, layers
+
+
+def ghz_circuit(n, coupling_map=None, root=None, phase=False):
+    """
+    :param n: number of qubits in the GHZ state
+    :param coupling_map: list of (a, b) physical qubit pairs, all-to-all if None
+    :param root: physical qubit holding the initial hadamard
+    :param phase: apply s to the root, giving the (|0..0> + i|1..1>)/sqrt(2) state of the Mermin tests
+    :return: qc, layout: GHZ circuit on n qubits, and the physical qubit of every circuit qubit
+    """
+    layout, layers = ghz_schedule(n, coupling_map, root)
+    index = {q: i for i, q in enumerate(layout)}
+
+    qc = QuantumCircuit(n)
+
+    qc.h(0)
+    for layer in layers:
+        for control, target in layer:
+            qc.cx(index[control], index[target])
+    if phase:
+        qc.s(0)
+    qc.barrier()
+
+    return qc, layout
+
+
+# fusion measurements are kept apart from the "c" data bits, in one single bit register per fusion
+# (fuse0, fuse1, ...): only a condition on a whole register converts to qiskit, and so runs on IBMQ
+FUSE_REGISTER = "fuse"
+
+
+def dynamic_ghz_circuit(n, phase=False):
+    """
+    Constant depth GHZ preparation with mid-circuit measurement and feed-forward,
+    on a line of n qubits:
+
+    1. even qubits go to |+>, odd qubit 2k+1 picks up the parity of its even
+       neighbours 2k and 2k+2 (two CNOT layers) and is measured into fuse<k>
+    2. even qubit 2j gets an X for every fuse<k> with k < j, which makes all
+       even qubits agree with qubit 0: a GHZ state on the even qubits
+    3. the measured qubits are reset and, with a trailing odd qubit for even n,
+       copy their left neighbour (one CNOT layer)
+
+    The quantum depth does not depend on n, only the classically controlled
+    Pauli corrections do.
+
+    :param n: number of qubits in the GHZ state
+    :param phase: apply s to qubit 0, giving the (|0..0> + i|1..1>)/sqrt(2) state of the Mermin tests
+    :return: qc: pytket circuit on n qubits, with (n-1)//2 single bit fuse registers
+    """
+    qc = Circuit(n)
+    fusers = [q for q in range(1, n, 2) if q + 1 < n]
+    fuse = [Bit("{}{}".format(FUSE_REGISTER, k), 0) for k in range(len(fusers))]
+    for bit in fuse:
+        qc.add_bit(bit)
+
+    for q in range(0, n, 2):
+        qc.H(q)
+
+    # parity of the two even neighbours
+    for q in fusers:
+        qc.CX(q - 1, q)
+    for q in fusers:
+        qc.CX(q + 1, q)
+
+    for k, q in enumerate(fusers):
+        qc.Measure(Qubit(q), fuse[k])
+
+    # Pauli frame corrections: even qubit 2j flips once per parity bit to its left
+    for k in range(len(fusers)):
+        for q in range(2 * (k + 1), n, 2):
+            qc.X(Qubit(q), condition_bits=[fuse[k]], condition_value=1)
+
+    for q in fusers:
+        qc.add_gate(OpType.Reset, [q])
+    for q in range(1, n, 2):
+        qc.CX(q - 1, q)
+
+    if phase:
+        qc.S(0)
+    qc.add_barrier(range(n))
+
+    return qc
@@ -0,0 +1,134 @@
+import numpy as np
+
+# Exact (noiseless, shot-free) reference values for the Bell experiments.
+# Everything here works on whole numpy arrays at once, so a curve over
+# thousands of angles costs a handful of array operations instead of a
+# simulator job.
+
+# hadamard and identity, used to rotate into the X basis before a Z measurement
+_H = np.array([[1, 1], [1, -1]]) / np.sqrt(2)
+_I = np.eye(2)
+
+# order of the four CHSH observables, same as make_chsh_circuit / compute_chsh_witness
+CHSH_OBSERVABLES = ['00', '01', '10', '11']
+
+
+def chsh_correlators_closed_form(theta_vec):
+    """
+    Ideal ZZ, ZX, XZ, XX correlators of the CHSH circuits, (|00>+|11>)/sqrt(2)
+    followed by ry(theta) on qubit 0.
+
+    :param theta_vec: array of angles between the bases of Alice and Bob
+    :return: zz, zx, xz, xx: arrays of the same shape as theta_vec
+    """
+    theta = np.asarray(theta_vec, dtype=float)
+    cos = np.cos(theta)
+    sin = np.sin(theta)
+
+    return cos, -sin, sin, cos.copy()
+
+
+def chsh_witness_closed_form(theta_vec):
+    """
+    Ideal CHSH witnesses, in closed form.
+
+    CHSH1 = ZZ + ZX - XZ + XX = 2*sqrt(2)*cos(theta + pi/4)
+    CHSH2 = ZZ - ZX + XZ + XX = 2*sqrt(2)*cos(theta - pi/4)
+
+    :param theta_vec: array of angles between the bases of Alice and Bob
+    :return: CHSH1, CHSH2: arrays of the same shape as theta_vec
+    """
+    theta = np.asarray(theta_vec, dtype=float)
+
+    chsh1 = 2 * np.sqrt(2) * np.cos(theta + np.pi / 4)
+    chsh2 = 2 * np.sqrt(2) * np.cos(theta - np.pi / 4)
+
+    return chsh1, chsh2
+
+
+def _ry(theta):
+    """
+    :param theta: 1d array of angles
+    :return: array of shape (len(theta), 2, 2), one ry matrix per angle
+    """
+    cos = np.cos(theta / 2)
+    sin = np.sin(theta / 2)
+
+    return np.stack([np.stack([cos, -sin], axis=-1),
+                     np.stack([sin, cos], axis=-1)], axis=-2)
+
+
+def chsh_correlators_statevector(theta_vec):
+    """
+    Ideal ZZ, ZX, XZ, XX correlators from a batched 2 qubit statevector, one
+    state per theta. This follows make_chsh_circuit gate by gate and is used to
+    cross check the closed form.
+
+    :param theta_vec: array of angles between the bases of Alice and Bob
+    :return: zz, zx, xz, xx: arrays of the same shape as theta_vec
+    """
+    theta = np.asarray(theta_vec, dtype=float)
+    flat = theta.reshape(-1)
+
+    # bell state as a tensor psi[q0, q1]
+    bell = np.zeros((2, 2))
+    bell[0, 0] = bell[1, 1] = 1 / np.sqrt(2)
+
+    # ry(theta) on qubit 0, for every theta at once: psi[t, q0, q1]
+    psi = np.einsum('tab,bc->tac', _ry(flat), bell)
+
+    # +1 for even parity outcomes, -1 for odd
+    parity = np.array([[1, -1], [-1, 1]])
+
+    correlators = []
+    for el in CHSH_OBSERVABLES:
+        u0 = _H if el[0] == '1' else _I
+        u1 = _H if el[1] == '1' else _I
+
+        rotated = np.einsum('ab,tbc,dc->tad', u0, psi, u1)
+        prob = np.abs(rotated) ** 2
+
+        correlators.append(np.einsum('tab,ab->t', prob, parity).reshape(theta.shape))
+
+    return tuple(correlators)
+
+
+def chsh_witness_statevector(theta_vec):
+    """
+    Ideal CHSH witnesses from the batched statevector.
+
+    :param theta_vec: array of angles between the bases of Alice and Bob
+    :return: CHSH1, CHSH2: arrays of the same shape as theta_vec
+    """
+    zz, zx, xz, xx = chsh_correlators_statevector(theta_vec)
+
+    return zz + zx - xz + xx, zz - zx + xz + xx
+
+
+# azimuthal angle of every measurement basis of the Mermin / Svetlichny scripts,
+# each measures cos(phi) X + sin(phi) Y
+BASIS_PHASES = {'x': 0.0, 'y': np.pi / 2, 'c': 3 * np.pi / 4, 'd': 5 * np.pi / 4}
+
+
+def ghz_correlator(string, phase=0.0):
+    """
+    Ideal correlator of (|0..0> + e^{i phase}|1..1>)/sqrt(2), measured in the
+    bases of string: cos(sum of the basis angles - phase).
+
+    :param string: Sequence of bases for measurements (e.g. xxy, yxyy, xxc)
+    :param phase: relative phase of the GHZ state, pi/2 for the iGHZ state of the Mermin tests
+    :return: expectation value
+    """
+    return float(np.cos(sum(BASIS_PHASES[b] for b in string) - phase))
+
+
+def ideal_value(correlators, coeffs, phase=0.0):
+    """
+    :param correlators: list of basis strings
+    :param coeffs: their coefficients in the inequality
+    :param phase: relative phase of the GHZ state
+    :return: ideal value of the inequality
+    """
+    angles = np.array([[BASIS_PHASES[b] for b in string] for string in correlators])
+
+    return float(np.asarray(coeffs, dtype=float) @ np.cos(angles.sum(axis=1) - phase))
@@ -0,0 +1,178 @@
+import math
+
+# Noise aware choice of physical qubits.
+#
+# Every connected n qubit subgraph of the coupling map is a candidate
+# layout. A candidate costs -log(1 - error) summed over the n-1 CNOTs of its
+# cheapest spanning tree (the GHZ preparation), rep readouts and rep-1
+# resets per qubit (a reset is a measurement and a conditional flip, so it
+# is charged the readout error). Candidates are enumerated with ESU, which
+# visits every connected subgraph exactly once, and branches that cannot
+# beat the best candidate found so far are cut. The calibration comes from
+# the backend pool. A pytket backend reads it once, when it is built, so the
+# pooled backend is built again once it is older than the pool's ttl; the
+# search result is kept for as long as the backend it was computed from.
+
+
+def _cost(error):
+    return -math.log(max(1 - error, 1e-12))
+
+
+def calibration(info):
+    """
+    :param info: pytket BackendInfo
+    :return: readout, edges: dict of physical qubit -> readout cost, dict of (a, b) with a < b -> CNOT cost
+    """
+    readout = {node.index[0]: _cost(e) for node, e in (info.averaged_readout_errors or {}).items()}
+
+    edges = {}
+    for (a, b), e in (info.averaged_edge_gate_errors or {}).items():
+        key = tuple(sorted((a.index[0], b.index[0])))
+        # both directions of a coupling may be reported, the better one is used
+        edges[key] = min(edges.get(key, float('inf')), _cost(e))
+
+    for a, b in edges:
+        readout.setdefault(a, 0.0)
+        readout.setdefault(b, 0.0)
+
+    return readout, edges
+
+
+def _neighbours(edges):
+    graph = {}
+    for a, b in edges:
+        graph.setdefault(a, set()).add(b)
+        graph.setdefault(b, set()).add(a)
+
+    return graph
+
+
+def spanning_tree(nodes, edges):
+    """
+    :param nodes: set of physical qubits
+    :param edges: dict of (a, b) -> cost
+    :return: cost, tree: cost of the cheapest spanning tree of the induced subgraph (Prim) and its edges
+    """
+    nodes = set(nodes)
+    start = min(nodes)
+    inside = {start}
+    total = 0.0
+    tree = []
+
+    while inside != nodes:
+        best = None
+        for (a, b), c in edges.items():
+            if (a in inside) != (b in inside) and a in nodes and b in nodes and (best is None or c < best[0]):
+                best = (c, a, b)
+        if best is None:
+            return float('inf'), tree
+
+        total += best[0]
+        tree.append((best[1], best[2]))
+        inside.update(best[1:])
+
+    return total, tree
+
+
+def subgraphs(graph, k, bound=None):
+    """
+    Connected k qubit subgraphs (ESU enumeration).
+
+    :param graph: dict of qubit -> set of neighbours
+    :param k: size of the subgraphs
+    :param bound: optional callable set of qubits -> False to cut the branch
+    :return: generator of frozensets
+    """
+    def extend(chosen, extension, root, reach):
+        if len(chosen) == k:
+            yield frozenset(chosen)
+            return
+
+        extension = set(extension)
+        while extension:
+            w = extension.pop()
+            grown = chosen | {w}
+            if bound is not None and not bound(grown):
+                continue
+
+            # exclusive neighbours of w, larger than the root, not yet next to the subgraph
+            new = set(u for u in graph[w] if u > root and u not in reach)
+            yield from extend(grown, extension | new, root, reach | new)
+
+    for root in sorted(graph):
+        reach = {root} | graph[root]
+        yield from extend({root}, set(u for u in graph[root] if u > root), root, reach)
+
+
+def best_layout(info, n, rep=1):
+    """
+    :param info: pytket BackendInfo with averaged readout and edge gate errors
+    :param n: number of qubits
+    :param rep: mid-circuit repetitions, every qubit is read rep times and reset rep-1 times
+    :return: qubits, cost: the chosen physical qubits ordered for a GHZ (root first, then breadth first), and their cost
+    """
+    readout, edges = calibration(info)
+    graph = _neighbours(edges)
+
+    node_weight = {q: (2 * rep - 1) * c for q, c in readout.items()}
+    cheapest_node = min(node_weight.values(), default=0.0)
+    cheapest_edge = min(edges.values(), default=0.0)
+
+    best = [float('inf'), None]
+
+    def bound(chosen):
+        # what is chosen so far, plus the cheapest possible rest
+        partial = sum(node_weight[q] for q in chosen)
+        return partial + (n - len(chosen)) * cheapest_node + (n - 1) * cheapest_edge < best[0]
+
+    for nodes in subgraphs(graph, n, bound):
+        cost = sum(node_weight[q] for q in nodes) + spanning_tree(nodes, edges)[0]
+        if cost < best[0]:
+            best[:] = [cost, nodes]
+
+    if best[1] is None:
+        raise ValueError("no connected set of {} qubits in the coupling map".format(n))
+
+    return _ghz_order(best[1], edges), best[0]
+
+
+def _ghz_order(nodes, edges):
+    """
+    :return: nodes in breadth first order from the best connected one, so qubit 0 of the circuit is the GHZ root
+    """
+    graph = {q: [r for r in sorted(nbrs) if r in nodes] for q, nbrs in _neighbours(edges).items() if q in nodes}
+    root = max(sorted(nodes), key=lambda q: len(graph.get(q, [])))
+
+    order = [root]
+    for q in order:
+        order.extend(r for r in graph.get(q, []) if r not in order)
+
+    return order
+
+
+# (device, n, rep) -> (build time of the backend the calibration came from, result)
+_layouts = {}
+
+
+def device_layout(device, n, rep=1, pool=None):
+    """
+    :param device: device name
+    :param n: number of qubits
+    :param rep: mid-circuit repetitions
+    :param pool: BackendPool to read the calibration from, backend_pool.pytket_pool if None
+    :return: qubits, cost, see best_layout; searched again only when the calibration was refreshed
+    """
+    if pool is None:
+        from backend_pool import pytket_pool as pool
+
+    backend = pool.get(device, max_age=pool.ttl)
+    created = pool.created(device)
+
+    cached = _layouts.get((device, n, rep))
+    if cached is not None and cached[0] == created:
+        return cached[1]
+
+    result = best_layout(backend.backend_info, n, rep)
+    _layouts[(device, n, rep)] = (created, result)
+
+    return result
@@ -1,5 +1,5 @@
 from qiskit import QuantumCircuit
-from pytket.extensions.qiskit import IBMQBackend
+from backend_pool import get_backend
 from pytket import Circuit
 from pytket.extensions.qiskit import qiskit_to_tk, tk_to_qiskit
 from pytket.utils import expectation_from_counts
@@ -303,7 +303,7 @@ for m in m3:
 
 device="ibm_oslo"
 # does this work for simulators as well? Could be useful to check optimal results.
-backend = IBMQBackend(device)
+backend = get_backend(device)
 
 start = time.time()
 print("compiling circuits...")
@@ -1,13 +1,16 @@
 from qiskit import QuantumCircuit
-from pytket.extensions.qiskit import IBMQBackend
+from backend_pool import get_backend
 from pytket import Circuit
-from pytket.extensions.qiskit import qiskit_to_tk, tk_to_qiskit
-from pytket.utils import expectation_from_counts
+from pytket.extensions.qiskit import qiskit_to_tk
+from packed_counts import PackedCounts
+from fragments import fragment_cache
 from pytket import OpType
-import collections
 import numpy as np
 import time
 
+# this script's circuits, kept apart from what the other scripts cache under the same keys
+fragments = fragment_cache.scoped("midcircuit")
+
 def mermin3():
     """
     :return: qc, GHZ state circuit with 3 qubits, phase of i
@@ -154,6 +157,34 @@ def measurements(string):
 
     return qc
 
+def correlator_circuit(ineq, prepare, string, rep):
+    """
+    :param ineq: inequality and number of qubits, e.g. mermin3
+    :param prepare: state preparation function, e.g. mermin3
+    :param string: Sequence of bases for measurements (e.g. XXY, YXYY, XXYYX)
+    :param rep: number of midcircuit measurements
+    :return: d: circuit measuring qubit h of repetition r into bit h+(r*qubit)
+    """
+    qubit=len(string)
+
+    c = fragments.get(('state', ineq, 1), lambda: qiskit_to_tk(prepare()))
+    c.append(fragments.get(('basis', string, 1), lambda: measurements(string)))
+    d = Circuit(0,rep*qubit)
+
+    for r in range(0,rep):
+        d.append(c)
+
+        # need to specify which measurements go where!
+        for h in range(0,qubit):
+            d.Measure(h,h+(r*qubit))
+
+        if (r<rep-1):
+            d.add_barrier(range(0, qubit))
+            for z in range(0,qubit):
+                d.add_gate(OpType.Reset, [z])
+
+    return d
+
 def Inequality(ineq, qubit, device, repp, shots):
     """
     Add documentation here
@@ -171,8 +202,6 @@ def Inequality(ineq, qubit, device, repp, shots):
     function_dict = {'mermin3': mermin3, 'mermin4': mermin4, 'mermin5': mermin5, 'mermin6': mermin6, 'mermin7': mermin7,
                      'svetlichny3': svet3, 'svetlichny4': svet4}
 
-    state=qiskit_to_tk( function_dict[ineq]() ).copy()
-
     # Mermin measurements for iGHZ state.
     m3=["xxy", "xyx", "yxx", "yyy"]
     coeff_m3= [1.0, 1.0, 1.0, -1.0]
@@ -278,31 +307,20 @@ def Inequality(ineq, qubit, device, repp, shots):
     for rep in repp:
         for m in correlator_dict[ineq]:
 
-            c = state.copy()
-            c.append(measurements(m))
-            d = Circuit(0,rep*qubit)
-
-            for r in range(0,rep):
-                d.append(c)
-
-                # need to specify which measurements go where!
-                for h in range(0,qubit):
-                    d.Measure(h,h+(r*qubit))
-
-                if (r<rep-1):
-                    d.add_barrier(range(0, qubit))
-                    for z in range(0,qubit):
-                        d.add_gate(OpType.Reset, [z])
-
+            # fragments (converted state, measurement layer, assembled circuit) are built once per process
+            d = fragments.get(('circuit', ineq, m, rep, 1),
+                              lambda: correlator_circuit(ineq, function_dict[ineq], m, rep))
             circ_list.append(d)
-            print(tk_to_qiskit(d))
+
+    # drawing hundreds of circuits costs more than building them, so only count them
+    print("circuits assembled: ", len(circ_list))
 
 
 
 
 
     # does this work for simulators as well? Could be useful to check optimal results.
-    backend = IBMQBackend(device)
+    backend = get_backend(device)
 
     start = time.time()
     print("compiling circuits...")
@@ -314,11 +332,11 @@ def Inequality(ineq, qubit, device, repp, shots):
     # shots needs to be the same length as circ_list!
 
 
-    # this will only work for 3 qubit mermin for now. need to generalize!
+    # one shot count per circuit: every correlator of a rep runs with that rep's shots
     temp=shots
     shots=np.array([],dtype='i')
     for sh in temp:
-        shots = np.concatenate((shots,[sh]*4))
+        shots = np.concatenate((shots,[sh]*len(correlator_dict[ineq])))
 
     print("shot list: ", shots)
 
@@ -330,30 +348,21 @@ def Inequality(ineq, qubit, device, repp, shots):
     expectation_arr=[]
 
     # result list will now have 24 results, not 4!
-    coeffs=coeff_dict[ineq]*5
+    coeffs=coeff_dict[ineq]*len(repp)
     print("coeff list: ", coeffs)
     z=1
     for coeff, result in zip(coeffs, result_list):
 
-        counts = result.get_counts()
-        d = collections.Counter()
-
-        for i in counts:
-            val = i
-            count = counts[i]
+        counts = PackedCounts.from_counts(result.get_counts())
 
-            # split the tuple into qubit(=3 now) pieces
-            val = tuple(val[x:x + qubit]
-                        for x in range(0, len(val), qubit))
+        # every qubit sized block is one repetition, all with the same number of shots
+        value = counts.block_expectations(qubit).mean()
 
-            for k in range(0, len(val)):
-                d[val[k]] = d[val[k]] + count
-
-        expectation += coeff * expectation_from_counts(d)
+        expectation += coeff * value
         # also print out the correlator string here for clarity
-        print(expectation_from_counts(d), coeff)
+        print(value, coeff)
 
-        if(z==4):
+        if(z==len(coeff_dict[ineq])):
             expectation_arr.append([expectation])
             expectation=0
             z=0
@@ -365,4 +374,9 @@ if __name__ == "__main__":
 
     # Experimentally computed inequality value
     expectation = Inequality(ineq="Mermin", qubit=3, device="ibm_nairobi", repp=[2, 4, 8, 16, 32], shots=[8192, 4096, 2048, 1024, 512])
-    print("Inequality values: ", expectation)
\ No newline at end of file
+    print("Inequality values: ", expectation)
+
+    # stored for later, headless plotting (python bell.py plot midcircuit.json)
+    from plotting import save_results
+    save_results("midcircuit.json", "inequality", ineq="mermin3", label="ibm_nairobi",
+                 rep=[2, 4, 8, 16, 32], values=[e[0] for e in expectation], bound=2)
\ No newline at end of file
@@ -0,0 +1,208 @@
+import numpy as np
+
+# Counts with the outcomes packed into uint64 words.
+#
+# A result of rep repetitions on n qubits has rep*n bits per outcome; as
+# tuple (or string) keys every analysis step slices and re-hashes them. Here
+# the unique outcomes are rows of a (n_unique, n_words) uint64 array, bit j in
+# word j // 64 at position j % 64, next to a count vector. Slicing,
+# marginalisation and parity are whole-array operations over the unique rows.
+
+
+def pack_bits(bits):
+    """
+    :param bits: (rows, n_bits) array of 0/1
+    :return: (rows, ceil(n_bits / 64)) uint64 array of packed words
+    """
+    bits = np.asarray(bits, dtype=np.uint8).reshape(len(bits), -1)
+    n_words = max(1, -(-bits.shape[1] // 64))
+
+    padded = np.zeros((bits.shape[0], n_words * 64), dtype=np.uint8)
+    padded[:, :bits.shape[1]] = bits
+
+    return np.packbits(padded, axis=1, bitorder='little').view('<u8')
+
+
+def unpack_bits(words, n_bits):
+    """
+    :param words: (rows, n_words) uint64 array of packed words
+    :param n_bits: number of meaningful bits
+    :return: (rows, n_bits) uint8 array of 0/1
+    """
+    words = np.ascontiguousarray(words, dtype='<u8')
+
+    return np.unpackbits(words.view(np.uint8), axis=1, bitorder='little')[:, :n_bits]
+
+
+def _popcount(words):
+    """
+    :param words: uint64 array
+    :return: number of set bits of every element
+    """
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+
+    # numpy < 2.0, SWAR popcount
+    words = words - ((words >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    words = (words & np.uint64(0x3333333333333333)) + ((words >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    words = (words + (words >> np.uint64(4))) & np.uint64(0x0f0f0f0f0f0f0f0f)
+
+    return (words * np.uint64(0x0101010101010101)) >> np.uint64(56)
+
+
+class PackedCounts:
+    """
+    Outcome counts over n_bits classical bits, one row per unique outcome.
+    """
+
+    def __init__(self, words, counts, n_bits):
+        """
+        :param words: (n_unique, n_words) uint64 array of packed outcomes
+        :param counts: (n_unique,) array of counts
+        :param n_bits: number of classical bits per outcome
+        """
+        self.words = words
+        self.counts = counts
+        self.n_bits = n_bits
+
+    @classmethod
+    def from_bits(cls, bits, counts=None):
+        """
+        :param bits: (rows, n_bits) array of 0/1, e.g. per-shot memory
+        :param counts: count of every row, 1 each if None
+        :return: PackedCounts, with duplicate rows merged
+        """
+        bits = np.asarray(bits, dtype=np.uint8)
+        if counts is None:
+            counts = np.ones(len(bits), dtype=np.int64)
+
+        return cls(pack_bits(bits), np.asarray(counts, dtype=np.int64), bits.shape[1]).merged()
+
+    @classmethod
+    def from_counts(cls, counts):
+        """
+        :param counts: dict of outcome -> count. Keys are tuples of bits, as pytket returns
+                       them, or qiskit bit strings (bit 0 rightmost, spaces between registers)
+        :return: PackedCounts
+        """
+        keys = list(counts.keys())
+        values = np.fromiter(counts.values(), dtype=np.int64, count=len(counts))
+
+        if keys and isinstance(keys[0], str):
+            keys = [k.replace(' ', '')[::-1] for k in keys]
+            bits = np.frombuffer(''.join(keys).encode(), dtype=np.uint8) - ord('0')
+        else:
+            bits = np.array(keys, dtype=np.uint8)
+
+        bits = bits.reshape(len(values), -1)
+
+        return cls(pack_bits(bits), values, bits.shape[1])
+
+    @classmethod
+    def concatenate(cls, parts):
+        """
+        :param parts: list of PackedCounts over the same bits, e.g. of several runs of one circuit
+        :return: PackedCounts of all their shots, duplicate outcomes merged
+        """
+        return cls(np.concatenate([p.words for p in parts]), np.concatenate([p.counts for p in parts]),
+                   parts[0].n_bits).merged()
+
+    def __len__(self):
+        return len(self.counts)
+
+    def total(self):
+        """
+        :return: total number of shots
+        """
+        return int(self.counts.sum())
+
+    def merged(self):
+        """
+        :return: PackedCounts with duplicate outcomes merged into one row
+        """
+        unique, inverse = np.unique(self.words, axis=0, return_inverse=True)
+        counts = np.bincount(inverse.reshape(-1), weights=self.counts, minlength=len(unique))
+
+        return PackedCounts(unique, counts.astype(np.int64), self.n_bits)
+
+    def bits(self):
+        """
+        :return: (n_unique, n_bits) uint8 array of the outcomes
+        """
+        return unpack_bits(self.words, self.n_bits)
+
+    def select(self, bits):
+        """
+        Marginal distribution over a subset of the bits.
+
+        :param bits: list of bit indices, in the order they should appear in the result
+        :return: PackedCounts over len(bits) bits, duplicates merged
+        """
+        bits = np.asarray(bits, dtype=np.int64)
+        words = self.words[:, bits // 64]
+        values = (words >> (bits % 64).astype(np.uint64)) & np.uint64(1)
+
+        return PackedCounts(pack_bits(values), self.counts, len(bits)).merged()
+
+    def slice(self, start, stop):
+        """
+        :param start: first bit
+        :param stop: one past the last bit
+        :return: marginal over bits start..stop-1
+        """
+        return self.select(range(start, stop))
+
+    def xor(self, flips):
+        """
+        :param flips: 0/1 per bit, e.g. the bits flipped before measurement
+        :return: PackedCounts with every outcome xor flips, the rows stay unique
+        """
+        return PackedCounts(self.words ^ pack_bits([flips])[0], self.counts, self.n_bits)
+
+    def _mask(self, bits):
+        """
+        :param bits: list of bit indices
+        :return: (n_words,) uint64 mask with those bits set
+        """
+        mask = np.zeros(self.words.shape[1], dtype=np.uint64)
+        for j in bits:
+            mask[j // 64] |= np.uint64(1) << np.uint64(j % 64)
+
+        return mask
+
+    def parity(self, bits=None):
+        """
+        :param bits: list of bit indices, all bits if None
+        :return: (n_unique,) int array, +1 for an even number of ones among the bits, -1 for odd
+        """
+        if bits is None:
+            bits = range(self.n_bits)
+
+        ones = _popcount(self.words & self._mask(bits)).sum(axis=1)
+
+        return 1 - 2 * (ones.astype(np.int64) & 1)
+
+    def expectation(self, bits=None):
+        """
+        :param bits: list of bit indices, all bits if None
+        :return: parity expectation value, same as pytket's expectation_from_counts on the marginal
+        """
+        return float(self.parity(bits) @ self.counts / self.counts.sum())
+
+    def block_expectations(self, block):
+        """
+        Parity expectation of every consecutive block of bits, e.g. every mid-circuit repetition.
+
+        :param block: bits per block
+        :return: (n_bits // block,) array of expectation values
+        """
+        n_blocks = self.n_bits // block
+        parities = np.stack([self.parity(range(b * block, (b + 1) * block)) for b in range(n_blocks)], axis=1)
+
+        return self.counts @ parities / self.counts.sum()
+
+    def to_dict(self):
+        """
+        :return: dict of outcome tuple -> count, as pytket's get_counts() returns it
+        """
+        return {tuple(int(b) for b in row): int(c) for row, c in zip(self.bits(), self.counts)}
@@ -0,0 +1,88 @@
+from pytket import Circuit
+from sympy import Symbol
+import numpy as np
+
+from ideal import BASIS_PHASES
+
+# Parametric measurement layers.
+#
+# A measurement along the Bloch sphere direction (theta, phi) is the rotation
+# rz(-phi) followed by ry(-theta) and a Z measurement. With theta and phi left
+# as symbols the circuit of an inequality is compiled once per device; every
+# correlator, angle scan point or optimisation step is then the compiled
+# circuit with the symbols substituted, no recompilation needed. pytket
+# angles are in half-turns, so the symbols hold angle / pi.
+
+# (theta, phi) of the fixed bases, all of them on the equator
+BASIS_ANGLES = {b: (np.pi / 2, phi) for b, phi in BASIS_PHASES.items()}
+
+
+def basis_angles(basis):
+    """
+    :param basis: a basis string (e.g. xxy) or a sequence with one basis symbol or (theta, phi) pair per qubit
+    :return: list of (theta, phi) per qubit, in radians
+    """
+    angles = []
+    for b in basis:
+        if isinstance(b, str):
+            if b not in BASIS_ANGLES:
+                raise ValueError("unrecognized basis symbol: {}".format(b))
+            angles.append(BASIS_ANGLES[b])
+        else:
+            theta, phi = b
+            angles.append((float(theta), float(phi)))
+
+    return angles
+
+
+def angle_symbols(n):
+    """
+    :param n: number of qubits
+    :return: thetas, phis: lists of sympy symbols, one per qubit
+    """
+    return [Symbol("theta_{}".format(i)) for i in range(n)], [Symbol("phi_{}".format(i)) for i in range(n)]
+
+
+def rotation_layer(n):
+    """
+    :param n: number of qubits
+    :return: qc: circuit rotating direction (theta_i, phi_i) of qubit i onto Z, still symbolic
+    """
+    thetas, phis = angle_symbols(n)
+    qc = Circuit(n, n)
+
+    for i in range(n):
+        qc.Rz(-phis[i], i)
+        qc.Ry(-thetas[i], i)
+
+    qc.add_barrier(range(n))
+
+    return qc
+
+
+def bindings(basis):
+    """
+    :param basis: see basis_angles
+    :return: dict of symbol -> value in half-turns, for Circuit.symbol_substitution
+    """
+    angles = basis_angles(basis)
+    thetas, phis = angle_symbols(len(angles))
+
+    values = {}
+    for (theta, phi), t, p in zip(angles, thetas, phis):
+        values[t] = theta / np.pi
+        values[p] = phi / np.pi
+
+    return values
+
+
+def bind(circuit, basis):
+    """
+    :param circuit: (compiled) circuit containing rotation_layer
+    :param basis: see basis_angles
+    :return: a copy of circuit measuring in basis
+    """
+    bound = circuit.copy()
+    bound.symbol_substitution(bindings(basis))
+
+    return bound
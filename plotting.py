@@ -0,0 +1,138 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import json
+import os
+
+import numpy as np
+
+from ideal import chsh_witness_closed_form
+
+# Headless plotting from saved result files.
+#
+# Experiments write their numbers to a small json file (save_results) and the
+# figures are rendered from those files with the Agg backend, in a background
+# thread (render_async) or a pool of worker processes (render_many). Nothing
+# here needs a display, a live result object or a backend session, so a
+# finished run can exit right away and plots can be regenerated later for any
+# number of stored runs.
+
+
+def save_results(path, kind, **data):
+    """
+    :param path: json file to write
+    :param kind: which renderer to use, a key of RENDERERS
+    :param data: the numbers to store (lists or numpy arrays)
+    :return: path
+    """
+    record = {'kind': kind}
+    for key, value in data.items():
+        record[key] = value.tolist() if isinstance(value, np.ndarray) else value
+
+    with open(path, 'w') as f:
+        json.dump(record, f)
+
+    return path
+
+
+def _draw_chsh(ax, data):
+    """
+    Measured CHSH witnesses against the exact noiseless curves.
+    """
+    theta_fine = np.linspace(0, 2 * np.pi, 500)
+    CHSH1_ideal, CHSH2_ideal = chsh_witness_closed_form(theta_fine)
+    label = data.get('label', 'device')
+
+    ax.plot(theta_fine, CHSH1_ideal, '-', label='CHSH1 Noiseless')
+    ax.plot(theta_fine, CHSH2_ideal, '-', label='CHSH2 Noiseless')
+
+    ax.plot(data['theta'], data['CHSH1'], 'x-', label='CHSH1 ' + label)
+    ax.plot(data['theta'], data['CHSH2'], 'x-', label='CHSH2 ' + label)
+
+    ax.axhline(y=2, color='r', linestyle='-')
+    ax.axhline(y=-2, color='r', linestyle='-')
+    ax.axhline(y=np.sqrt(2) * 2, color='k', linestyle='-.')
+    ax.axhline(y=-np.sqrt(2) * 2, color='k', linestyle='-.')
+    ax.set_xlabel('Theta')
+    ax.set_ylabel('CHSH witness')
+
+
+def _draw_inequality(ax, data):
+    """
+    Bell values against the number of mid-circuit repetitions.
+    """
+    ax.plot(data['rep'], data['values'], 'o-', label=data.get('label', data.get('ineq', '')))
+
+    if 'bound' in data:
+        ax.axhline(y=data['bound'], color='r', linestyle='-', label='local bound')
+
+    ax.set_xscale('log', base=2)
+    ax.set_xlabel('Repetitions')
+    ax.set_ylabel('Inequality value')
+
+
+RENDERERS = {'chsh': _draw_chsh, 'inequality': _draw_inequality}
+
+
+def render(result_path, out_path):
+    """
+    Render one stored result with the Agg backend. The output format follows the
+    extension of out_path (png, svg, pdf, ...).
+
+    :param result_path: json file written by save_results
+    :param out_path: image file to write
+    :return: out_path
+    """
+    # the object oriented api keeps no global pyplot state, so this is safe in threads
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    with open(result_path) as f:
+        data = json.load(f)
+
+    fig = Figure(figsize=(12, 8))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+
+    RENDERERS[data['kind']](ax, data)
+
+    ax.grid(which='major', axis='both')
+    ax.legend(fontsize=16)
+    fig.savefig(out_path)
+
+    return out_path
+
+
+_thread_pool = None
+
+
+def render_async(result_path, out_path):
+    """
+    :param result_path: json file written by save_results
+    :param out_path: image file to write
+    :return: concurrent.futures.Future, resolving to out_path
+    """
+    global _thread_pool
+
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="plotting")
+
+    return _thread_pool.submit(render, result_path, out_path)
+
+
+def render_many(result_paths, out_dir=None, fmt='png', processes=None):
+    """
+    Render stored results in parallel worker processes.
+
+    :param result_paths: list of json files written by save_results
+    :param out_dir: directory of the images, next to each result file if None
+    :param fmt: image format / extension
+    :param processes: number of worker processes, one per cpu if None
+    :return: list of written image files
+    """
+    out_paths = []
+    for path in result_paths:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        directory = out_dir if out_dir is not None else os.path.dirname(path)
+        out_paths.append(os.path.join(directory, stem + '.' + fmt))
+
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return list(pool.map(render, result_paths, out_paths))
@@ -0,0 +1,173 @@
+from pytket import Circuit, OpType
+from pytket.circuit import Bit
+import numpy as np
+import time
+
+# Tensored (per-qubit) readout error mitigation.
+#
+# Each physical qubit q gets a 2x2 assignment matrix A_q[measured, prepared],
+# calibrated from two circuits (everything in |0>, everything in |1>). The
+# full assignment matrix is assumed to be the Kronecker product of the A_q, so
+# its inverse is the Kronecker product of the inverses. For a parity
+# expectation we never need the inverse itself, only the row [1, -1] @ inv(A_q)
+# of every qubit: the mitigated <Z...Z> is the count-weighted mean of the
+# product of those per-qubit weights over the measured bits. That is
+# O(unique outcomes x bits), no matter how large n*rep gets.
+
+
+def measured_qubits(circuit, n_bits):
+    """
+    :param circuit: compiled pytket circuit
+    :param n_bits: number of classical bits to look up, rep*qubit to cover every mid-circuit repetition
+    :return: list of physical qubit indices, the qubit measured into each of bits 0..n_bits-1
+    """
+    qubits = [None] * n_bits
+
+    for cmd in circuit.get_commands():
+        if cmd.op.type == OpType.Measure:
+            bit = cmd.args[1]
+            if bit.reg_name == "c" and bit.index[0] < n_bits and qubits[bit.index[0]] is None:
+                qubits[bit.index[0]] = cmd.args[0].index[0]
+
+    if None in qubits:
+        raise ValueError("circuit does not measure all of the first {} bits".format(n_bits))
+
+    return qubits
+
+
+def calibration_circuits(nodes):
+    """
+    :param nodes: list of physical qubits (pytket Nodes) to calibrate
+    :return: [zero, one]: circuits preparing all qubits in |0> and in |1>, bit i reads nodes[i]
+    """
+    circuits = []
+
+    for prepared in (0, 1):
+        qc = Circuit()
+        for i, node in enumerate(nodes):
+            qc.add_qubit(node)
+            qc.add_bit(Bit(i))
+        for i, node in enumerate(nodes):
+            if prepared:
+                qc.X(node)
+            qc.Measure(node, Bit(i))
+        circuits.append(qc)
+
+    return circuits
+
+
+def _bit_matrix(counts):
+    """
+    :param counts: dict of outcome tuple -> count
+    :return: outcomes, an (n_unique, n_bits) uint8 array, and the matching count vector
+    """
+    outcomes = np.array(list(counts.keys()), dtype=np.uint8)
+    shots = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+
+    return outcomes.reshape(len(counts), -1), shots
+
+
+def assignment_matrices(zero_counts, one_counts):
+    """
+    :param zero_counts: counts of the all |0> calibration circuit
+    :param one_counts: counts of the all |1> calibration circuit
+    :return: array of shape (n_qubits, 2, 2), A[q, measured, prepared]
+    """
+    zero_bits, zero_shots = _bit_matrix(zero_counts)
+    one_bits, one_shots = _bit_matrix(one_counts)
+
+    # probability of reading 1, per qubit, for each preparation
+    p1_given0 = zero_shots @ zero_bits / zero_shots.sum()
+    p1_given1 = one_shots @ one_bits / one_shots.sum()
+
+    matrices = np.empty((zero_bits.shape[1], 2, 2))
+    matrices[:, 0, 0] = 1 - p1_given0
+    matrices[:, 1, 0] = p1_given0
+    matrices[:, 0, 1] = 1 - p1_given1
+    matrices[:, 1, 1] = p1_given1
+
+    return matrices
+
+
+def parity_weights(matrices):
+    """
+    :param matrices: array of shape (n_qubits, 2, 2) of assignment matrices
+    :return: array of shape (n_qubits, 2), [1, -1] @ inv(A_q) for every qubit
+    """
+    return np.einsum('j,qjk->qk', np.array([1.0, -1.0]), np.linalg.inv(matrices))
+
+
+def mitigated_expectation(packed, qubit, matrices):
+    """
+    Mitigated parity expectation, averaged over all repetition blocks of the
+    outcome (the same quantity as the unmitigated block_expectations(qubit).mean()).
+
+    :param packed: PackedCounts, rep*qubit bits per outcome
+    :param qubit: number of bits per repetition block
+    :param matrices: array of shape (rep*qubit, 2, 2), the assignment matrix of the qubit measured into each bit;
+                     a repetition may read a different physical qubit than the one before
+    :return: mitigated expectation value
+    """
+    weights = parity_weights(matrices)
+    expectation = 0
+
+    for start in range(0, packed.n_bits, qubit):
+        # at most 2^qubit rows once marginalised onto one block
+        block = packed.slice(start, start + qubit)
+        per_row = weights[start + np.arange(qubit), block.bits()].prod(axis=-1)
+        expectation += block.counts @ per_row / block.counts.sum()
+
+    return float(expectation / (packed.n_bits // qubit))
+
+
+class CalibrationCache:
+    """
+    Assignment matrices per device and per physical qubit, each stored with
+    the time it was calibrated. A calibration older than max_age is dropped on
+    lookup.
+    """
+
+    def __init__(self, max_age=3600, clock=time.time):
+        """
+        :param max_age: seconds a calibration stays valid
+        :param clock: callable returning the current time in seconds
+        """
+        self.max_age = max_age
+        self.clock = clock
+        self._cache = {}
+
+    def get(self, device, qubits):
+        """
+        :param device: device name
+        :param qubits: list of physical qubit indices
+        :return: array of shape (len(qubits), 2, 2), or None if any qubit has no calibration younger than max_age
+        """
+        now = self.clock()
+        calibrated = self._cache.get(device, {})
+
+        # forget every stale calibration of this device
+        for q in [q for q, (timestamp, _) in calibrated.items() if now - timestamp > self.max_age]:
+            del calibrated[q]
+
+        if not all(q in calibrated for q in qubits):
+            return None
+
+        return np.array([calibrated[q][1] for q in qubits])
+
+    def update(self, device, qubits, matrices, timestamp=None):
+        """
+        :param device: device name
+        :param qubits: list of physical qubit indices
+        :param matrices: array of shape (len(qubits), 2, 2)
+        :param timestamp: time the calibration circuits ran, now if None
+        """
+        if timestamp is None:
+            timestamp = self.clock()
+
+        calibrated = self._cache.setdefault(device, {})
+        for q, matrix in zip(qubits, matrices):
+            calibrated[q] = (timestamp, np.asarray(matrix))
+
+
+# shared by every Inequality() call in the process
+calibration_cache = CalibrationCache()
@@ -0,0 +1,215 @@
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+from packed_counts import PackedCounts, pack_bits
+from shot_stream import result_chunks
+
+# Columnar on-disk archive of experiment runs.
+#
+# Every run is a directory holding its spec as json plus one .npy file per
+# column:
+#
+#   spec.json           spec, compiled circuit hashes, bits per circuit
+#   keys.npy            (n_unique, n_words) uint64, packed outcomes of all circuits
+#   counts.npy          (n_unique,) uint32, count of every outcome
+#   offsets.npy         (n_circuits + 1,) int64, rows of keys/counts per circuit
+#   memory.npy          (n_shots, n_words) uint64, packed per-shot outcomes (optional)
+#   memory_offsets.npy  (n_circuits + 1,) int64, rows of memory per circuit (optional)
+#
+# Outcome bit j lives in word j // 64 at position j % 64. Plain .npy (not
+# .npz) so that load_run can memory map every column: reloading thousands of
+# runs reads nothing until a column is actually touched.
+
+
+def circuit_hash(circuit):
+    """
+    :param circuit: pytket circuit
+    :return: sha256 hex digest of its serialised form
+    """
+    serial = json.dumps(circuit.to_dict(), sort_keys=True)
+
+    return hashlib.sha256(serial.encode()).hexdigest()
+
+
+def save_run(root, spec, circuits, results, memory=False, run_id=None):
+    """
+    :param root: archive directory, one sub directory per run
+    :param spec: json serialisable dict describing the run (inequality, n, rep, shots, device, ...)
+    :param circuits: compiled pytket circuits, in submission order
+    :param results: pytket BackendResults, one per circuit
+    :param memory: also store the per-shot outcomes
+    :param run_id: name of the run directory, a timestamp if None
+    :return: path of the run directory
+    """
+    if run_id is None:
+        run_id = time.strftime("%Y%m%d-%H%M%S") + "-{:06d}".format(int(time.time() * 1e6) % 1000000)
+    path = os.path.join(root, run_id)
+    os.makedirs(path)
+
+    keys, counts, n_bits = [], [], []
+    shots, offsets, memory_offsets = [], [0], [0]
+
+    for result in results:
+        if memory:
+            # packed chunk by chunk, the counts columns are the unique rows of the memory, no counts dict
+            parts, width = [], 0
+            for chunk in result_chunks(result):
+                parts.append(pack_bits(chunk))
+                width = chunk.shape[1]
+            shots.append(np.concatenate(parts))
+            memory_offsets.append(memory_offsets[-1] + len(shots[-1]))
+
+            packed = PackedCounts(shots[-1], np.ones(len(shots[-1]), dtype=np.int64), width).merged()
+        else:
+            packed = PackedCounts.from_counts(result.get_counts())
+
+        keys.append(packed.words)
+        counts.append(packed.counts.astype(np.uint32))
+        n_bits.append(packed.n_bits)
+        offsets.append(offsets[-1] + len(packed))
+
+    # circuits of different widths are padded to the widest one
+    n_words = max(k.shape[1] for k in keys)
+    pad = lambda w: np.pad(w, ((0, 0), (0, n_words - w.shape[1])))
+
+    np.save(os.path.join(path, "keys.npy"), np.concatenate([pad(k) for k in keys]))
+    np.save(os.path.join(path, "counts.npy"), np.concatenate(counts))
+    np.save(os.path.join(path, "offsets.npy"), np.array(offsets, dtype=np.int64))
+
+    if memory:
+        np.save(os.path.join(path, "memory.npy"), np.concatenate([pad(s) for s in shots]))
+        np.save(os.path.join(path, "memory_offsets.npy"), np.array(memory_offsets, dtype=np.int64))
+
+    record = {'spec': spec,
+              'circuit_hashes': [circuit_hash(c) for c in circuits],
+              'n_bits': n_bits,
+              'memory': bool(memory)}
+    with open(os.path.join(path, "spec.json"), 'w') as f:
+        json.dump(record, f, indent=1)
+
+    return path
+
+
+class ArchivedRun:
+    """
+    A run loaded from the archive. All columns are read only memory maps.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: run directory written by save_run
+        """
+        self.path = path
+
+        with open(os.path.join(path, "spec.json")) as f:
+            record = json.load(f)
+
+        self.spec = record['spec']
+        self.circuit_hashes = record['circuit_hashes']
+        self.n_bits = record['n_bits']
+        self.has_memory = record['memory']
+
+        load = lambda name: np.load(os.path.join(path, name), mmap_mode='r')
+        self.keys = load("keys.npy")
+        self.count_column = load("counts.npy")
+        self.offsets = load("offsets.npy")
+
+        if self.has_memory:
+            self.memory_column = load("memory.npy")
+            self.memory_offsets = load("memory_offsets.npy")
+
+    def __len__(self):
+        return len(self.n_bits)
+
+    def packed(self, i):
+        """
+        :param i: index of the circuit
+        :return: keys, counts: views of circuit i's packed outcomes and counts, no copy
+        """
+        start, stop = self.offsets[i], self.offsets[i + 1]
+
+        return self.keys[start:stop], self.count_column[start:stop]
+
+    def packed_counts(self, i):
+        """
+        :param i: index of the circuit
+        :return: PackedCounts of circuit i, backed by the memory maps
+        """
+        keys, counts = self.packed(i)
+
+        return PackedCounts(keys, counts, self.n_bits[i])
+
+    def counts(self, i):
+        """
+        :param i: index of the circuit
+        :return: dict of outcome tuple -> count, as BackendResult.get_counts() returns it
+        """
+        return self.packed_counts(i).to_dict()
+
+    def memory(self, i):
+        """
+        :param i: index of the circuit
+        :return: view of circuit i's packed per-shot outcomes, (n_shots, n_words) uint64
+        """
+        if not self.has_memory:
+            raise ValueError("run {} was archived without per-shot memory".format(self.path))
+
+        return self.memory_column[self.memory_offsets[i]:self.memory_offsets[i + 1]]
+
+
+def load_run(path):
+    """
+    :param path: run directory written by save_run
+    :return: ArchivedRun
+    """
+    return ArchivedRun(path)
+
+
+def list_runs(root):
+    """
+    :param root: archive directory
+    :return: sorted list of run directories in it
+    """
+    return sorted(os.path.join(root, name) for name in os.listdir(root)
+                  if os.path.isfile(os.path.join(root, name, "spec.json")))
+
+
+def reanalyse(run):
+    """
+    Recompute the Bell value of an archived Inequality() run, without device access.
+
+    :param run: ArchivedRun whose spec holds qubit, rep and coeffs
+    :return: expectation: bell-type inequality value
+    """
+    qubit = run.spec['qubit']
+    coeffs = run.spec['coeffs']
+
+    # one circuit whose repetitions cycle through the correlators
+    if run.spec.get('interleave'):
+        data = range(qubit * run.spec['rep'] * len(coeffs))
+        values = run.packed_counts(0).select(data).block_expectations(qubit).reshape(-1, len(coeffs)).mean(axis=0)
+        return float(values @ coeffs)
+
+    # bits past the rep*qubit data bits are ancilla measurements (e.g. the dynamic GHZ fusion bits)
+    data = range(qubit * run.spec.get('rep', 1))
+
+    # every correlator ran folded by every scale factor, linear fit to zero noise as Inequality() does
+    if run.spec.get('zne'):
+        scales = run.spec['zne']
+        values = np.array([run.packed_counts(i).select(data).block_expectations(qubit).mean()
+                           for i in range(len(scales) * len(coeffs))]).reshape(len(scales), -1)
+        return float(np.polyfit(scales, values @ coeffs, 1)[-1])
+
+    # every correlator ran as len(masks) instances with readout flips, undone before the parity
+    if run.spec.get('twirl'):
+        masks = run.spec['twirl']
+        return sum(coeff * PackedCounts.concatenate([run.packed_counts(i * len(masks) + k).select(data).xor(mask)
+                                                     for k, mask in enumerate(masks)]).block_expectations(qubit).mean()
+                   for i, coeff in enumerate(coeffs))
+
+    return sum(coeff * run.packed_counts(i).select(data).block_expectations(qubit).mean()
+               for i, coeff in enumerate(run.spec['coeffs']))
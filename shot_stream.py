@@ -0,0 +1,78 @@
+import numpy as np
+
+# Streaming analysis of per-shot memory.
+#
+# At large rep*qubit almost every shot is a unique outcome, so a counts dict
+# has as many entries as there are shots. In memory mode the per-shot outcomes
+# are read in fixed size chunks and folded straight into one parity sum per
+# (correlator, repetition); no counts are ever built and the accumulator
+# stays the same size however many shots or repetitions there are.
+
+CHUNK_SIZE = 8192
+
+
+def result_chunks(result, chunk_size=CHUNK_SIZE, cbits=None):
+    """
+    The shots are read once through BackendResult.get_shots, one uint8 per
+    outcome bit, and handed out chunk by chunk, so the analysis of a chunk
+    never holds more than chunk_size shots of intermediate arrays.
+
+    :param result: pytket BackendResult of a circuit run with per-shot memory
+    :param chunk_size: shots per chunk
+    :param cbits: bits to read, in order, all bits of the result if None
+    :return: generator of (shots, n_bits) uint8 arrays
+    """
+    shots = result.get_shots() if cbits is None else result.get_shots(cbits=cbits)
+
+    for start in range(0, len(shots), chunk_size):
+        yield shots[start:start + chunk_size]
+
+
+class ParityAccumulator:
+    """
+    Running parity sums for every correlator and every mid-circuit repetition.
+    """
+
+    def __init__(self, n_correlators, qubit, rep):
+        """
+        :param n_correlators: number of correlator circuits
+        :param qubit: bits per repetition block
+        :param rep: repetitions per circuit
+        """
+        self.qubit = qubit
+        self.rep = rep
+        self.sums = np.zeros((n_correlators, rep))
+        self.shots = np.zeros(n_correlators, dtype=np.int64)
+
+    def add(self, correlator, chunk, weights=None):
+        """
+        :param correlator: index of the correlator the shots belong to
+        :param chunk: (shots, n_bits) array of 0/1, bit h + r*qubit is qubit h in repetition r
+        :param weights: optional (rep*qubit, 2) readout mitigation weights of every bit
+                        (see readout_mitigation.parity_weights)
+        """
+        bits = np.asarray(chunk)[:, :self.qubit * self.rep].reshape(len(chunk), self.rep, self.qubit)
+
+        if weights is None:
+            values = 1 - 2 * (bits.sum(axis=2, dtype=np.int64) & 1)
+        else:
+            weights = weights.reshape(self.rep, self.qubit, 2)
+            values = weights[np.arange(self.rep)[:, None], np.arange(self.qubit), bits].prod(axis=2)
+
+        self.sums[correlator] += values.sum(axis=0)
+        self.shots[correlator] += len(chunk)
+
+    def consume(self, correlator, chunks, weights=None):
+        """
+        :param correlator: index of the correlator the shots belong to
+        :param chunks: iterable of chunks, e.g. result_chunks(result)
+        :param weights: optional (rep*qubit, 2) readout mitigation weights
+        """
+        for chunk in chunks:
+            self.add(correlator, chunk, weights)
+
+    def expectations(self):
+        """
+        :return: (n_correlators, rep) array, parity expectation of every correlator in every repetition
+        """
+        return self.sums / self.shots[:, None]
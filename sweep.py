@@ -0,0 +1,173 @@
+from dataclasses import dataclass, field
+import itertools
+import json
+import time
+
+from packed_counts import PackedCounts
+from results_archive import circuit_hash
+from cost_estimate import estimate, enforce, device_timings
+
+# Declarative sweeps over inequality x qubits x rep x shots x device.
+#
+# A SweepSpec expands into sweep points. Every point needs one circuit per
+# correlator; plan() builds those once per distinct (inequality, qubits,
+# basis, rep), keys them by their structural hash, and run() compiles each
+# distinct circuit once per device and executes each distinct (circuit, shots)
+# pair once, all of a device's work in a single process_circuits call. The
+# results are routed back to every point that asked for them.
+
+
+@dataclass(frozen=True)
+class SweepPoint:
+    ineq: str
+    qubit: int
+    rep: int
+    shots: int
+    device: str
+
+
+@dataclass
+class SweepSpec:
+    inequalities: list = field(default_factory=lambda: ['mermin'])
+    qubits: list = field(default_factory=lambda: [3])
+    reps: list = field(default_factory=lambda: [1])
+    shots: list = field(default_factory=lambda: [16384])
+    devices: list = field(default_factory=lambda: ['ibm_oslo'])
+    # [[rep, shots], ...] pairs, used instead of the reps x shots product when given
+    rep_shots: list = None
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        :param path: .json, .yaml or .yml file with the fields of SweepSpec
+        :return: SweepSpec
+        """
+        with open(path) as f:
+            if path.endswith(('.yaml', '.yml')):
+                import yaml
+
+                data = yaml.safe_load(f)
+            else:
+                data = json.load(f)
+
+        return cls(**data)
+
+    def points(self):
+        """
+        :return: list of SweepPoint, one per combination
+        """
+        rep_shots = self.rep_shots or list(itertools.product(self.reps, self.shots))
+
+        return [SweepPoint(ineq.lower(), qubit, rep, shots, device)
+                for device in self.devices
+                for ineq in self.inequalities
+                for qubit in self.qubits
+                for rep, shots in rep_shots]
+
+
+class SweepPlan:
+    """
+    Distinct circuits of a sweep and, per point, which of them it needs.
+    """
+
+    def __init__(self, points):
+        self.points = points
+        self.circuits = {}      # hash -> uncompiled pytket circuit
+        self.needs = {}         # point -> list of hashes, one per correlator
+        self.coeffs = {}        # point -> list of coefficients
+
+    def executions(self, device):
+        """
+        :param device: device name
+        :return: sorted list of distinct (hash, shots) pairs the device has to run
+        """
+        return sorted(set((h, point.shots) for point in self.points if point.device == device
+                          for h in self.needs[point]))
+
+    def summary(self):
+        """
+        :return: dict with the number of points, requested circuits, distinct circuits and executions
+        """
+        devices = sorted(set(point.device for point in self.points))
+
+        return {'points': len(self.points),
+                'requested_circuits': sum(len(h) for h in self.needs.values()),
+                'distinct_circuits': len(self.circuits),
+                'compilations': sum(len(set(h for h, _ in self.executions(d))) for d in devices),
+                'executions': sum(len(self.executions(d)) for d in devices),
+                'devices': len(devices)}
+
+
+def plan(spec, inequality):
+    """
+    :param spec: SweepSpec
+    :param inequality: the experiment module (bell.load_script('inequality'))
+    :return: SweepPlan
+    """
+    sweep_plan = SweepPlan(spec.points())
+    built = {}
+
+    for point in sweep_plan.points:
+        name = point.ineq + str(point.qubit)
+
+        hashes = []
+        for m in inequality.correlator_dict[name]:
+            key = (name, m, point.rep)
+            if key not in built:
+                circuit = inequality.correlator_circuit(name, m, point.rep)
+                built[key] = circuit_hash(circuit)
+                sweep_plan.circuits.setdefault(built[key], circuit)
+            hashes.append(built[key])
+
+        sweep_plan.needs[point] = hashes
+        sweep_plan.coeffs[point] = inequality.coeff_dict[name]
+
+    return sweep_plan
+
+
+def run(sweep_plan, backend_for, budget=None, reshape=False, timings_for=None):
+    """
+    :param sweep_plan: SweepPlan
+    :param backend_for: callable device name -> pytket backend, e.g. backend_pool.get_backend
+    :param budget: QPU seconds per device, checked against cost_estimate before submission
+    :param reshape: scale the shots down to fit the budget instead of rejecting the sweep
+    :param timings_for: callable device name -> GateTimings, cost_estimate.device_timings if None
+    :return: dict of SweepPoint -> bell-type inequality value
+    """
+    values = {}
+
+    for device in sorted(set(point.device for point in sweep_plan.points)):
+        backend = backend_for(device)
+        executions = sweep_plan.executions(device)
+
+        # every distinct circuit is compiled once, whatever shot counts it runs with
+        hashes = sorted(set(h for h, _ in executions))
+        start = time.time()
+        compiled = dict(zip(hashes, backend.get_compiled_circuits([sweep_plan.circuits[h] for h in hashes],
+                                                                   optimisation_level=2)))
+        print(device, ": compiled", len(hashes), "circuits in", time.time() - start, "seconds")
+
+        circuits = [compiled[h] for h, _ in executions]
+        n_shots = [shots for _, shots in executions]
+
+        if budget is not None:
+            timings = (timings_for or device_timings)(device)
+            cost = estimate(circuits, n_shots, timings)
+            print(device, ": estimated cost", cost.summary())
+            n_shots = enforce(cost, seconds=budget, reshape=reshape)
+
+        # results stay keyed by the requested shots, the values are normalised expectations either way
+        handles = backend.process_circuits(circuits, n_shots=n_shots)
+        results = dict(zip(executions, backend.get_results(handles)))
+
+        for point in sweep_plan.points:
+            if point.device != device:
+                continue
+
+            value = 0
+            for h, coeff in zip(sweep_plan.needs[point], sweep_plan.coeffs[point]):
+                counts = PackedCounts.from_counts(results[(h, point.shots)].get_counts())
+                value += coeff * counts.block_expectations(point.qubit).mean()
+            values[point] = value
+
+    return values
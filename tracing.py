@@ -0,0 +1,217 @@
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+# Timing spans for the stages of an experiment.
+#
+# Every stage (circuit construction, tk conversion, compilation, submission,
+# queue wait, execution, result download, analysis) runs inside
+# tracer.span(name, **attributes). Finished spans are kept in memory and can
+# be exported as Chrome trace JSON (chrome://tracing or ui.perfetto.dev) or
+# printed as a per-stage summary table. With memory tracing on, every span
+# also records the tracemalloc peak reached while it was open.
+
+
+class Span:
+
+    def __init__(self, name, attributes, start, thread):
+        self.name = name
+        self.attributes = attributes
+        self.start = start
+        self.end = None
+        self.thread = thread
+        self.peak = None        # bytes, only with memory tracing
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+
+class Tracer:
+    """
+    Collects finished spans, thread safe.
+    """
+
+    def __init__(self, memory=False, clock=time.perf_counter):
+        """
+        :param memory: record the tracemalloc peak of every span
+        :param clock: callable returning the current time in seconds
+        """
+        self.clock = clock
+        self.spans = []
+        self.memory = False
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        if memory:
+            self.trace_memory()
+
+    def trace_memory(self):
+        """
+        Starts tracemalloc (if it is not running) and records peaks from now on.
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.memory = True
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """
+        :param name: stage name, e.g. compile
+        :param attributes: json serialisable attributes, e.g. ineq, n, rep, circuits, shots
+        :return: context manager yielding the Span, attributes can still be added to span.attributes
+        """
+        stack = self._stack()
+        span = Span(name, attributes, self.clock(), threading.get_ident())
+
+        # tracemalloc has a single peak: hand what was reached so far to the enclosing span, then restart it
+        if self.memory:
+            if stack:
+                stack[-1].peak = max(stack[-1].peak or 0, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+
+        stack.append(span)
+        try:
+            yield span
+        finally:
+            stack.pop()
+            span.end = self.clock()
+
+            if self.memory:
+                span.peak = max(span.peak or 0, tracemalloc.get_traced_memory()[1])
+                if stack:
+                    stack[-1].peak = max(stack[-1].peak or 0, span.peak)
+
+            with self._lock:
+                self.spans.append(span)
+
+    def clear(self):
+        with self._lock:
+            self.spans = []
+
+    def chrome_trace(self):
+        """
+        :return: dict in the Chrome trace event format, one complete ("X") event per span
+        """
+        origin = min((span.start for span in self.spans), default=0)
+        events = []
+        for span in self.spans:
+            args = dict(span.attributes)
+            if span.peak is not None:
+                args['peak_bytes'] = span.peak
+            events.append({'name': span.name, 'ph': 'X', 'pid': os.getpid(), 'tid': span.thread,
+                           'ts': (span.start - origin) * 1e6, 'dur': span.duration * 1e6, 'args': args})
+
+        return {'traceEvents': sorted(events, key=lambda e: e['ts']), 'displayTimeUnit': 'ms'}
+
+    def export(self, path):
+        """
+        :param path: json file to write the Chrome trace to
+        """
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f, default=str)
+
+    def summary(self):
+        """
+        :return: dict of span name -> {'count', 'total', 'mean', 'max', 'peak'}, in order of first appearance
+        """
+        table = {}
+        for span in sorted(self.spans, key=lambda s: s.start):
+            row = table.setdefault(span.name, {'count': 0, 'total': 0.0, 'max': 0.0, 'peak': None})
+            row['count'] += 1
+            row['total'] += span.duration
+            row['max'] = max(row['max'], span.duration)
+            if span.peak is not None:
+                row['peak'] = max(row['peak'] or 0, span.peak)
+
+        for row in table.values():
+            row['mean'] = row['total'] / row['count']
+
+        return table
+
+    def format_summary(self):
+        """
+        :return: the summary as a printable table, times in seconds and peaks in MB
+        """
+        lines = ["{:<14}{:>7}{:>12}{:>12}{:>12}{:>11}".format('stage', 'count', 'total', 'mean', 'max', 'peak MB')]
+        for name, row in self.summary().items():
+            peak = "-" if row['peak'] is None else "{:.1f}".format(row['peak'] / 2 ** 20)
+            lines.append("{:<14}{:>7}{:>12.4f}{:>12.4f}{:>12.4f}{:>11}".format(
+                name, row['count'], row['total'], row['mean'], row['max'], peak))
+
+        return "\n".join(lines)
+
+
+def wait_for_results(backend, handles, tracer, poll=2.0, **attributes):
+    """
+    Waits for submitted circuits with a queue span (until none of them is
+    queued any more) and an execution span (until all are done), then
+    downloads the results in a download span.
+
+    :param backend: pytket backend the handles were submitted to
+    :param handles: list of ResultHandles
+    :param tracer: Tracer
+    :param poll: seconds between status queries
+    :param attributes: attributes of the three spans
+    :return: list of BackendResults
+    """
+    from pytket.backends.status import StatusEnum
+
+    waiting = (StatusEnum.SUBMITTED, StatusEnum.QUEUED)
+    done = (StatusEnum.COMPLETED, StatusEnum.ERROR, StatusEnum.CANCELLED)
+
+    def statuses():
+        return [backend.circuit_status(handle).status for handle in handles]
+
+    with tracer.span("queue", **attributes):
+        current = statuses()
+        while any(s in waiting for s in current):
+            time.sleep(poll)
+            current = statuses()
+
+    with tracer.span("execution", **attributes):
+        while not all(s in done for s in current):
+            time.sleep(poll)
+            current = statuses()
+
+    with tracer.span("download", **attributes):
+        return backend.get_results(handles)
+
+
+def wait_for_job(job, tracer, poll=2.0, **attributes):
+    """
+    Same as wait_for_results, for a qiskit job.
+
+    :param job: qiskit job, e.g. from backend.run
+    :param tracer: Tracer
+    :param poll: seconds between status queries
+    :param attributes: attributes of the three spans
+    :return: the job's qiskit Result
+    """
+    waiting = ('INITIALIZING', 'VALIDATING', 'QUEUED')
+    done = ('DONE', 'ERROR', 'CANCELLED')
+
+    with tracer.span("queue", **attributes):
+        status = job.status().name
+        while status in waiting:
+            time.sleep(poll)
+            status = job.status().name
+
+    with tracer.span("execution", **attributes):
+        while status not in done:
+            time.sleep(poll)
+            status = job.status().name
+
+    with tracer.span("download", **attributes):
+        return job.result()
+
+
+# shared by every script in the process
+tracer = Tracer()
@@ -0,0 +1,90 @@
+from pytket import Circuit
+from sympy import Symbol
+import numpy as np
+
+from packed_counts import PackedCounts
+
+# Twirled readout.
+#
+# Readout error is asymmetric: an excited qubit decays during the measurement,
+# so 1 is misread as 0 more often than the reverse, which biases every
+# correlator. Flipping a random set of qubits with X right before they are
+# measured, and flipping the recorded bits back in the analysis, averages the
+# two directions into a symmetric error that only shrinks the correlators.
+# Every measured bit j gets an Rx(flip_j) before its measurement (half-turns,
+# Rx(1) is X up to a global phase), so a correlator circuit is compiled once
+# with the flips left symbolic; an instance is a copy of the compiled circuit
+# with 0 or 1 bound per bit. Masks come in complementary pairs, so with an
+# even number of instances every bit is flipped in exactly half of them.
+
+
+def flip_symbols(n_bits):
+    """
+    :param n_bits: number of measured bits
+    :return: list of sympy symbols, one per bit
+    """
+    return [Symbol("flip_{}".format(j)) for j in range(n_bits)]
+
+
+def flip_layer(qubit, r):
+    """
+    :param qubit: number of qubits
+    :param r: mid-circuit repetition, qubit h is measured into bit h + r*qubit
+    :return: qc: circuit flipping qubit h by the symbol of its bit in repetition r
+    """
+    symbols = flip_symbols((r + 1) * qubit)[r * qubit:]
+    qc = Circuit(qubit)
+
+    for h in range(qubit):
+        qc.Rx(symbols[h], h)
+
+    return qc
+
+
+def flip_masks(instances, n_bits, seed=None):
+    """
+    :param instances: number of twirled instances
+    :param n_bits: number of measured bits
+    :param seed: random seed
+    :return: (instances, n_bits) uint8 array, row i is 1 where instance i flips the bit
+    """
+    rng = np.random.default_rng(seed)
+    half = rng.integers(0, 2, size=(-(-instances // 2), n_bits), dtype=np.uint8)
+
+    return np.concatenate([half, 1 - half])[:instances]
+
+
+def flip_bindings(mask):
+    """
+    :param mask: 0/1 per bit
+    :return: dict of symbol -> 0 or 1, for Circuit.symbol_substitution
+    """
+    return {s: int(m) for s, m in zip(flip_symbols(len(mask)), mask)}
+
+
+def instances(template, masks, bindings=None):
+    """
+    :param template: compiled circuit containing the flip layers of every repetition
+    :param masks: flip masks, see flip_masks
+    :param bindings: other symbols of the template to bind, e.g. parametric.bindings(basis)
+    :return: list of circuits, one copy of template per mask
+    """
+    circuits = []
+    for mask in masks:
+        values = dict(bindings or {})
+        values.update(flip_bindings(mask))
+
+        c = template.copy()
+        c.symbol_substitution(values)
+        circuits.append(c)
+
+    return circuits
+
+
+def untwirl(counts, masks):
+    """
+    :param counts: PackedCounts of every instance, over the data bits the masks cover
+    :param masks: the flip mask of every instance
+    :return: PackedCounts of all instances together, with the flips undone
+    """
+    return PackedCounts.concatenate([c.xor(mask) for c, mask in zip(counts, masks)])
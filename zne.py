@@ -0,0 +1,95 @@
+from pytket import Circuit, OpType
+import numpy as np
+
+# Zero-noise extrapolation.
+#
+# Every two-qubit gate G of a compiled circuit is folded into G (G^dagger G)^k,
+# the same unitary with k extra pairs of the noisiest gates, i.e. noise scale
+# factor 2k+1. The folding is done on the compiled circuit: the compiler runs
+# once per correlator whatever the number of scale factors, and it never sees
+# the folds, so it cannot cancel them (barriers between the folded gates keep
+# later passes from doing so). The daggers of cx, ecr and cz are native again,
+# so folded circuits stay in the device's gate set. The Bell value of every
+# scale factor is fitted with a polynomial in the scale factor and evaluated
+# at zero. Its error comes from a parametric bootstrap: every correlator is
+# redrawn from the binomial distribution of its shots and all resampled
+# curves are fitted in a single polyfit call.
+
+DEFAULT_SCALES = (1, 3, 5)
+
+
+def fold(circuit, scale):
+    """
+    :param circuit: compiled pytket circuit
+    :param scale: noise scale factor, an odd integer
+    :return: circuit with every two-qubit gate G followed by (scale - 1) / 2 pairs of G^dagger G
+    """
+    if scale < 1 or scale % 2 != 1:
+        raise ValueError("scale factors are odd positive integers, got {}".format(scale))
+    if scale == 1:
+        return circuit
+
+    folded = Circuit()
+    for q in circuit.qubits:
+        folded.add_qubit(q)
+    for b in circuit.bits:
+        folded.add_bit(b)
+
+    for cmd in circuit.get_commands():
+        op = cmd.op
+        if op.type == OpType.Barrier:
+            folded.add_barrier(cmd.args)
+            continue
+
+        folded.add_gate(op, cmd.args)
+
+        # measurements, resets and conditional gates touch bits or a single qubit, they are never folded
+        if len(cmd.qubits) == 2 and not cmd.bits:
+            for _ in range((scale - 1) // 2):
+                folded.add_barrier(cmd.qubits)
+                folded.add_gate(op.dagger, cmd.args)
+                folded.add_barrier(cmd.qubits)
+                folded.add_gate(op, cmd.args)
+
+    folded.add_phase(circuit.phase)
+
+    return folded
+
+
+def extrapolate(scales, values, order=1):
+    """
+    :param scales: noise scale factors
+    :param values: (n_scales,) values, or (n_scales, n_curves) to fit many curves at once
+    :param order: degree of the fitted polynomial, len(scales) - 1 for Richardson extrapolation
+    :return: the fitted value(s) at scale factor 0
+    """
+    if order >= len(scales):
+        raise ValueError("a fit of order {} needs more than {} scale factors".format(order, len(scales)))
+
+    return np.polyfit(np.asarray(scales, dtype=float), np.asarray(values, dtype=float), order)[-1]
+
+
+def zero_noise(scales, correlators, coeffs, samples, order=1, resamples=2000, seed=None):
+    """
+    :param scales: noise scale factors
+    :param correlators: (n_scales, n_correlators) measured correlator values
+    :param coeffs: coefficient of every correlator in the inequality
+    :param samples: number of +-1 values averaged into every correlator, e.g. shots * rep
+    :param order: see extrapolate
+    :param resamples: bootstrap resamples
+    :param seed: random seed of the bootstrap
+    :return: value, error, per_scale: the extrapolated Bell value, its bootstrap standard error and the
+             Bell value of every scale factor
+    """
+    correlators = np.asarray(correlators, dtype=float)
+    coeffs = np.asarray(coeffs, dtype=float)
+    per_scale = correlators @ coeffs
+
+    # (resamples, n_scales, n_correlators) redrawn correlators, then one fit per resample
+    rng = np.random.default_rng(seed)
+    ones = rng.binomial(samples, np.clip((1 + correlators) / 2, 0, 1), size=(resamples,) + correlators.shape)
+    curves = (2 * ones / samples - 1) @ coeffs
+
+    fits = extrapolate(scales, curves.T, order)
+
+    return float(extrapolate(scales, per_scale, order)), float(fits.std(ddof=1)), per_scale